@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Layered compositor for a SuperPixel strand, so several effects can draw on
+overlapping pixels at the same time without the last write winning.
+
+Each Layer is a canvas the size of the whole strand, drawn on like a strand
+(PixelGrids work on it, as do effects.draw() and effects.steps()), plus a
+mask of the pixels it covers. Layers stack bottom to top, each with its own
+opacity and blend mode:
+    normal   - the layer's colors, over what's below
+    add      - the layer's colors added to what's below, up to 255
+    multiply - what's below, scaled by the layer's colors / 255
+    max      - the brighter of the layer and what's below, per channel
+Blended colors are mixed with what's below by the layer's mask times its
+opacity, so a mask can be a hard set of pixels, or a soft alpha per pixel.
+
+The compositor flattens every layer into one frame, in whole-array
+operations, and hands it to the strand. It only flattens when a layer has
+changed, at most once per frame: as a RenderLoop producer, it flattens on
+the render thread (add it after any EffectScheduler drawing on its layers,
+so a step is on the pixels the same frame); without one, at show().
+Pixels no visible layer covers are black.
+
+For the EffectScheduler, Layer.fadeSteps() fades a layer's colors, and
+Layer.fadeOpacitySteps() fades it in or out over what's below.
+
+Usage:
+    compositor = Compositor(super_strand, render_loop)
+    ambience = compositor.addLayer('ambience')
+    buttons = compositor.addLayer('buttons', button_grid)
+    eruption = compositor.addLayer('eruption', rattan_grid, blend='add')
+    buttons.grid().setPixelColorRGB(AMBER_LED, 0, 64, 64, 64)
+    eruption.setOpacity(0.5)
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import threading
+import time
+
+import numpy
+
+import pixelcolor
+import superpixel
+from metrics import METRICS
+
+# Ways to combine a layer with the layers below it
+BLEND_NORMAL = 'normal'
+BLEND_ADD = 'add'
+BLEND_MULTIPLY = 'multiply'
+BLEND_MAX = 'max'
+BLEND_MODES = (BLEND_NORMAL, BLEND_ADD, BLEND_MULTIPLY, BLEND_MAX)
+
+
+class Layer(object):
+    def __init__(self, compositor, name, num_pixels, mask=None, opacity=1.0, blend=BLEND_NORMAL):
+        """One layer of a Compositor. Create it with Compositor.addLayer().
+
+        Writes land in the layer's own canvas, and are composited at the
+        compositor's next flatten; pixels outside the mask are kept in the
+        canvas, but never shown.
+        """
+        self._compositor = compositor
+        self.name = name
+        self._pixels = pixelcolor.newFrame(num_pixels)
+        self._grid = None
+        self._alpha = None  # mask * opacity, num_pixels by 1, float32
+        self._mask = None
+        self._opacity = 1.0
+        self._blend = BLEND_NORMAL
+        self._visible = True
+        self.setBlend(blend)
+        self.setOpacity(opacity)
+        self.setMask(mask)
+
+    #####
+    #
+    # Compositing
+    #
+    #####
+
+    def setMask(self, mask=None):
+        """Set the pixels the layer covers.
+        mask: None, for every pixel; a PixelGrid on the compositor's strand,
+              for its pixels (see grid()); an array of pixel positions; a
+              boolean array, one per pixel; or a float array of 0.0-1.0
+              alphas, one per pixel
+        """
+        num_pixels = len(self._pixels)
+        self._grid = None
+        if mask is None:
+            coverage = numpy.ones(num_pixels, dtype=numpy.float32)
+        elif hasattr(mask, 'pixelIndices'):
+            coverage = numpy.zeros(num_pixels, dtype=numpy.float32)
+            coverage[mask.pixelIndices()] = 1.0
+            self._grid = mask.onStrand(self)
+        else:
+            mask = numpy.asarray(mask)
+            if mask.dtype == bool or mask.dtype.kind == 'f':
+                if mask.shape != (num_pixels,):
+                    raise ValueError('A mask of flags or alphas needs one per pixel: {0}'.format(mask.shape))
+                coverage = numpy.clip(mask, 0.0, 1.0).astype(numpy.float32)
+            else:
+                coverage = numpy.zeros(num_pixels, dtype=numpy.float32)
+                coverage[mask] = 1.0
+        with self._compositor._lock:
+            self._mask = coverage
+            self._updateAlpha()
+
+    def setOpacity(self, opacity):
+        """Set the layer's opacity, 0.0 (invisible) to 1.0."""
+        with self._compositor._lock:
+            self._opacity = min(1.0, max(0.0, float(opacity)))
+            if self._mask is not None:
+                self._updateAlpha()
+
+    def opacity(self):
+        """Return the layer's opacity, 0.0-1.0."""
+        return self._opacity
+
+    def setBlend(self, blend):
+        """Set the layer's blend mode, one of BLEND_MODES."""
+        if blend not in BLEND_MODES:
+            raise ValueError('Unknown blend mode: {0}'.format(blend))
+        with self._compositor._lock:
+            self._blend = blend
+            self._compositor._changed = True
+
+    def blend(self):
+        """Return the layer's blend mode."""
+        return self._blend
+
+    def setVisible(self, visible):
+        """Show or hide the layer, keeping what's drawn on it."""
+        with self._compositor._lock:
+            self._visible = bool(visible)
+            self._compositor._changed = True
+
+    def visible(self):
+        """Return True if the layer is shown."""
+        return self._visible and self._opacity > 0.0
+
+    def grid(self):
+        """Return the PixelGrid the layer is masked to, drawing on this layer
+        rather than straight on the strand, or None if it has no grid.
+        """
+        return self._grid
+
+    def _updateAlpha(self):
+        """Recombine the mask and opacity. Call holding the compositor lock."""
+        self._alpha = (self._mask * self._opacity)[:, numpy.newaxis]
+        self._compositor._changed = True
+
+    #####
+    #
+    # Strand interface, for PixelGrids and effects
+    #
+    #####
+
+    def begin(self):
+        """Nothing to set up: the compositor's strand is begun by its owner."""
+        pass
+
+    def show(self):
+        """Show the compositor's layers, this one included."""
+        self._compositor.show()
+
+    def numPixels(self):
+        """Return the number of pixels in the layer (the whole strand)."""
+        return len(self._pixels)
+
+    def getPixels(self):
+        """Return the layer's canvas, as a pixel count by 3 (RGB) uint8
+        array. Call markChanged() after changing it directly.
+        """
+        return self._pixels
+
+    def getPixelColor(self, n):
+        """Get the [R, G, B] color array for the pixel at position n."""
+        return self._pixels[n]
+
+    def markChanged(self):
+        """Flag the layer to be composited again at the next flatten."""
+        self._compositor._changed = True
+
+    def setPixelColor(self, n, color_rgb):
+        """Set the pixel at position n to the provided color as [R, G, B]."""
+        self.setPixelColorRGB(n, color_rgb[0], color_rgb[1], color_rgb[2])
+
+    def setPixelColorRGB(self, n, red, green, blue):
+        """Set the pixel at position n to the provided red, green, and blue
+        color, each 0-255.
+        """
+        if n >= len(self._pixels):
+            return  # out of bounds; throw it away
+        with self._compositor._lock:
+            self._pixels[n] = (red, green, blue)
+            self._compositor._changed = True
+
+    def setPixels(self, colors):
+        """Set every pixel from an array of [R, G, B] rows, one per pixel."""
+        self.setRange(0, len(self._pixels), colors)
+
+    def setRange(self, start, stop, colors):
+        """Set pixels from start up to (not including) stop, from either one
+        [R, G, B] color for the whole range, or (stop - start) [R, G, B] rows.
+        """
+        clipped = pixelcolor.clipRange(start, stop, colors, len(self._pixels))
+        if clipped is None:
+            return  # out of bounds; throw it away
+        start, stop, colors = clipped
+        with self._compositor._lock:
+            self._pixels[start:stop] = colors
+            self._compositor._changed = True
+
+    def setPixelsAt(self, indices, colors):
+        """Set the pixels at an array of positions, from either one [R, G, B]
+        color for every position, or len(indices) [R, G, B] rows.
+        """
+        indices, colors = pixelcolor.clipIndices(indices, colors, len(self._pixels))
+        with self._compositor._lock:
+            self._pixels[indices] = colors
+            self._compositor._changed = True
+
+    def fill(self, color):
+        """Set every pixel to the provided color as [R, G, B]."""
+        self.setRange(0, len(self._pixels), color)
+
+    def clear(self):
+        """Set every pixel to black."""
+        self.fill(pixelcolor.BLACK)
+
+    #####
+    #
+    # Fades, for the EffectScheduler
+    #
+    # Each is a generator which sets the step due at the current time, then
+    # yields None, until the fade is done.
+    #
+    #####
+
+    def fadeSteps(self, new_colors, seconds, easing='linear'):
+        """Fade the layer's canvas from its current colors to new_colors, a
+        pixel count by 3 (RGB) array, as SuperPixel.fadeSteps does for the
+        strand.
+        easing: name of a curve in superpixel.FADE_EASING, or a function
+        """
+        for frame_colors in superpixel.fadeFrames(self._pixels, new_colors, seconds, easing):
+            self.setPixels(frame_colors)
+            yield None
+
+    def fadeOpacitySteps(self, opacity, seconds, easing='linear'):
+        """Fade the layer's opacity from where it is now to opacity."""
+        curve = superpixel.easingCurve(easing)
+        start_opacity = self._opacity
+        for progress in superpixel.fadeProgress(seconds):
+            self.setOpacity(start_opacity + (opacity - start_opacity) * curve(progress))
+            yield None
+
+
+class Compositor(object):
+    def __init__(self, strand, render_loop=None):
+        """Class to stack layers of pixels, and flatten them onto a strand.
+
+        strand      - The SuperPixel (or compatible strand) to flatten onto
+        render_loop - RenderLoop to flatten from, once per frame. If None,
+                      layers are flattened when shown.
+        """
+        self._strand = strand
+        self._render_loop = render_loop
+        self._layers = []  # bottom to top
+        # Guards the layers and their canvases, so a frame is flattened
+        # between writes, never in the middle of one
+        self._lock = threading.RLock()
+        # True when a layer has changed since the last flatten
+        self._changed = True
+
+        # Scratch space for flattening, and the flattened frame
+        num_pixels = strand.numPixels()
+        self._composite = numpy.zeros((num_pixels, 3), dtype=numpy.float32)
+        self._blended = numpy.zeros((num_pixels, 3), dtype=numpy.float32)
+        self._frame = pixelcolor.newFrame(num_pixels)
+
+        if render_loop is not None:
+            render_loop.addProducer(self)
+
+    def addLayer(self, name, mask=None, opacity=1.0, blend=BLEND_NORMAL, index=None):
+        """Add a layer, on top of the others, or at position index from the
+        bottom. Layer names are unique.
+        mask:    the pixels the layer covers; see Layer.setMask()
+        opacity: float, 0.0-1.0
+        blend:   one of BLEND_MODES
+        Return the new Layer.
+        """
+        if self.layer(name) is not None:
+            raise ValueError('There is already a layer named {0}'.format(name))
+        layer = Layer(self, name, len(self._frame), mask, opacity, blend)
+        with self._lock:
+            if index is None:
+                self._layers.append(layer)
+            else:
+                self._layers.insert(index, layer)
+            self._changed = True
+        return layer
+
+    def removeLayer(self, name):
+        """Remove a layer. Does nothing if there is no layer by that name."""
+        with self._lock:
+            layer = self.layer(name)
+            if layer is not None:
+                self._layers.remove(layer)
+                self._changed = True
+
+    def layer(self, name):
+        """Return the layer named name, or None."""
+        for layer in self._layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def layers(self):
+        """Return the layers, bottom to top."""
+        return list(self._layers)
+
+    def flatten(self):
+        """Composite every visible layer, bottom to top, and return the frame,
+        as a pixel count by 3 (RGB) uint8 array. The same array is reused by
+        every flatten, so copy it to keep it.
+        """
+        timing = METRICS.enabled
+        if timing:
+            start_time = time.perf_counter()
+        composite = self._composite
+        blended = self._blended
+        with self._lock:
+            self._changed = False
+            composite.fill(0.0)
+            for layer in self._layers:
+                if not layer.visible():
+                    continue
+                pixels = layer._pixels
+                if layer._blend == BLEND_NORMAL:
+                    numpy.copyto(blended, pixels)
+                elif layer._blend == BLEND_ADD:
+                    numpy.add(composite, pixels, out=blended)
+                    numpy.minimum(blended, 255.0, out=blended)
+                elif layer._blend == BLEND_MULTIPLY:
+                    numpy.multiply(composite, pixels, out=blended)
+                    numpy.multiply(blended, 1.0 / 255.0, out=blended)
+                else:
+                    numpy.maximum(composite, pixels, out=blended)
+                # composite += (blended - composite) * alpha
+                numpy.subtract(blended, composite, out=blended)
+                numpy.multiply(blended, layer._alpha, out=blended)
+                numpy.add(composite, blended, out=composite)
+            numpy.rint(composite, out=composite)
+            numpy.copyto(self._frame, composite, casting='unsafe')
+        if timing:
+            METRICS.record('composite', time.perf_counter() - start_time)
+        return self._frame
+
+    def changed(self):
+        """Return True if a layer has changed since the last flatten."""
+        return self._changed
+
+    def __call__(self, frame_time):
+        """Return the flattened frame if a layer has changed, or else None.
+        Called by the RenderLoop once per frame.
+        """
+        if not self._changed:
+            return None
+        return self.flatten()
+
+    def show(self):
+        """Flatten the layers onto the strand, if they've changed, and show
+        it. With a RenderLoop, the render thread flattens them at its next
+        frame instead.
+        """
+        if self._render_loop is None and self._changed:
+            self._strand.setPixels(self.flatten())
+        self._strand.show()
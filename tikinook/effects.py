@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Procedural effects which draw a whole frame at a time.
+
+Each effect is a generator of frames: numpy uint8 arrays of [R, G, B] rows,
+one row per pixel, for any strand or PixelGrid with setPixels(). Frames are
+built with index arithmetic into WHEEL_LUT, not one pixel at a time, and
+each generator draws into the same frame array every time, so copy a frame
+to keep it past the next one.
+
+Play one on its own, with a wait between frames:
+    effects.draw(strand, effects.rainbowCycle(strand.numPixels()), wait_ms=20)
+
+Or run one on an EffectScheduler, which shows each frame on the RenderLoop:
+    scheduler.run(effects.steps(grid, effects.theaterChaseRainbow(grid.numPixels())))
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import time
+
+import numpy
+
+
+def _wheel_lut():
+    """Return the rainbow wheel() colors for every position 0-255, as a
+    256 by 3 (RGB) uint8 array.
+    """
+    pos = numpy.arange(256)
+    lut = numpy.zeros((256, 3), dtype=numpy.uint8)
+    rising = (pos - numpy.minimum(pos // 85, 2) * 85) * 3
+    falling = 255 - rising
+    first, second, third = pos < 85, (pos >= 85) & (pos < 170), pos >= 170
+    lut[first, 0], lut[first, 1] = rising[first], falling[first]
+    lut[second, 0], lut[second, 2] = falling[second], rising[second]
+    lut[third, 1], lut[third, 2] = rising[third], falling[third]
+    return lut
+
+
+# Rainbow colors across 0-255 wheel positions
+WHEEL_LUT = _wheel_lut()
+
+
+def wheel(pos):
+    """Return the rainbow [R, G, B] color for wheel position 0-255."""
+    return WHEEL_LUT[pos & 255]
+
+
+#####
+#
+# Effects
+#
+# Each takes the number of pixels to draw for, and yields frames.
+#
+#####
+
+def _wheel_frames(positions, iterations, modulo=256):
+    """Yield one frame per wheel step, 256 steps per iteration, with each
+    pixel's color at (its position + step) on the wheel.
+    """
+    frame = numpy.zeros((len(positions), 3), dtype=numpy.uint8)
+    index = numpy.empty(len(positions), dtype=numpy.intp)
+    for j in range(256 * iterations):
+        numpy.add(positions, j, out=index)
+        numpy.remainder(index, modulo, out=index)
+        numpy.take(WHEEL_LUT, index, axis=0, out=frame)
+        yield frame
+
+
+def rainbow(num_pixels, iterations=1):
+    """Rainbow that fades across all pixels at once."""
+    return _wheel_frames(numpy.arange(num_pixels), iterations)
+
+
+def rainbowCycle(num_pixels, iterations=2):
+    """Rainbow that uniformly distributes itself across all pixels."""
+    return _wheel_frames(numpy.arange(num_pixels) * 256 // max(1, num_pixels), iterations)
+
+
+def theaterChase(num_pixels, color, iterations=5):
+    """Movie theater marquee style chaser: every third pixel lit, stepping
+    along one pixel per frame.
+    """
+    frame = numpy.zeros((num_pixels, 3), dtype=numpy.uint8)
+    color = numpy.asarray(color, dtype=numpy.uint8)
+    for j in range(iterations):
+        for q in range(3):
+            frame[:] = 0
+            frame[q::3] = color
+            yield frame
+
+
+def theaterChaseRainbow(num_pixels, iterations=1):
+    """Rainbow movie theater marquee style chaser."""
+    frame = numpy.zeros((num_pixels, 3), dtype=numpy.uint8)
+    positions = numpy.arange(0, num_pixels, 3)
+    index = numpy.empty(len(positions), dtype=numpy.intp)
+    for j in range(256 * iterations):
+        numpy.add(positions, j, out=index)
+        numpy.remainder(index, 255, out=index)
+        for q in range(3):
+            frame[:] = 0
+            lit = frame[q::3]
+            numpy.take(WHEEL_LUT, index[:len(lit)], axis=0, out=lit)
+            yield frame
+
+
+def colorWipe(num_pixels, color, background=None):
+    """Wipe color across the display a pixel at a time, one frame per pixel.
+    background: the colors being wiped over, as one [R, G, B] or a frame;
+                black if None
+    """
+    frame = numpy.zeros((num_pixels, 3), dtype=numpy.uint8)
+    if background is not None:
+        frame[:] = numpy.asarray(background)[:num_pixels]
+    color = numpy.asarray(color, dtype=numpy.uint8)
+    for i in range(num_pixels):
+        frame[i] = color
+        yield frame
+
+
+#####
+#
+# Playing effects
+#
+#####
+
+def draw(target, frames, wait_ms=0):
+    """Set and show each frame on a strand or PixelGrid, waiting wait_ms
+    between frames.
+    """
+    for frame in frames:
+        target.setPixels(frame)
+        target.show()
+        if wait_ms:
+            time.sleep(wait_ms / 1000.0)
+
+
+def steps(target, frames):
+    """Set each frame on a strand or PixelGrid, yielding after each one, for
+    an EffectScheduler to show on the RenderLoop.
+    """
+    for frame in frames:
+        target.setPixels(frame)
+        yield
+
+
+def wipe(strip, color, wait_ms=0):
+    """Wipe color across a strand a pixel at a time, showing each step and
+    waiting wait_ms between them. Each step writes only the lit pixels,
+    with setRange(), so the strand's own colors are never read back.
+    """
+    for i in range(strip.numPixels()):
+        strip.setRange(0, i + 1, color)
+        strip.show()
+        if wait_ms:
+            time.sleep(wait_ms / 1000.0)
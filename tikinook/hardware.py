@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Picks the hardware backends the tiki nook code talks to: the real Raspberry
+Pi libraries, or in-memory stand-ins from simulator.py, so the controller,
+fades and video playback can all run (and be profiled) off a Pi.
+
+The backend is chosen by the TIKINOOK_BACKEND environment variable:
+    hardware  - _rpi_ws281x, Adafruit_GPIO.SPI, RPi.GPIO (default)
+    simulator - simulator.py
+e.g.:
+    TIKINOOK_BACKEND=simulator python3 nook_controller.py --ip 127.0.0.1
+
+Or call use_backend() before importing neopixel, paleopixel, superpixel or
+nook_controller, which load their backends at import time.
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import importlib
+import os
+
+HARDWARE = 'hardware'
+SIMULATOR = 'simulator'
+
+_backend = os.environ.get('TIKINOOK_BACKEND', HARDWARE)
+
+
+def use_backend(name):
+    """Select the backend, HARDWARE or SIMULATOR."""
+    global _backend
+    if name not in (HARDWARE, SIMULATOR):
+        raise ValueError('Unknown backend: {0}'.format(name))
+    _backend = name
+
+
+def backend():
+    """Return the name of the selected backend."""
+    return _backend
+
+
+def is_simulated():
+    """Return True if the simulator backend is selected."""
+    return _backend == SIMULATOR
+
+
+def _load(module_name):
+    """Import a hardware module, or the simulator in its place."""
+    if is_simulated():
+        return importlib.import_module('simulator')
+    return importlib.import_module(module_name)
+
+
+def ws281x():
+    """Return the ws281x (NeoPixel) driver module."""
+    return _load('_rpi_ws281x')
+
+
+def spi():
+    """Return the SPI module, with SpiDev and MSBFIRST."""
+    return _load('Adafruit_GPIO.SPI')
+
+
+def gpio():
+    """Return the GPIO module, as RPi.GPIO."""
+    if is_simulated():
+        return importlib.import_module('simulator').GPIO
+    return importlib.import_module('RPi.GPIO')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Per-frame instrumentation for the pixel pipeline.
+
+When enabled, the render path records into rolling histograms (the last
+HISTOGRAM_SIZE samples of each, in milliseconds):
+    effect         - time the RenderLoop spends running effects, per frame
+    frame          - time between RenderLoop frames
+    routing        - time inside SuperPixel writes, routing pixels to the
+                     sub-strands
+    show.N.Type    - time in show() for each SuperPixel sub-strand (or
+                     show.N+M.Type, for sub-strands sharing one render)
+    composite      - time a Compositor spends flattening its layers
+    input.SOURCE   - time from an input event (a GPIO button, or OSC) to the
+                     first show() after it
+and counters:
+    frames         - RenderLoop frames
+    frames.late    - RenderLoop frames missed against the target fps
+    fade.dropped   - fade_to_colors frames skipped to stay on time
+    player.dropped - PixelPlayer frames skipped to stay on time
+
+Query it with METRICS.snapshot(), or log a summary line every so often with
+METRICS.startLogging(). nook_controller also replies to OSC /stats.
+
+When disabled (the default), the hot path pays one attribute check:
+    if METRICS.enabled:
+        ...
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import threading
+import time
+
+import numpy
+
+# Samples kept in each rolling histogram
+HISTOGRAM_SIZE = 1024
+
+# Seconds between log lines
+STATS_LOG_SECONDS = 60
+
+
+class RollingHistogram(object):
+    def __init__(self, size=HISTOGRAM_SIZE):
+        """The last size samples of a measurement, in a ring buffer."""
+        self._samples = numpy.zeros(size, dtype=numpy.float64)
+        self._count = 0
+
+    def add(self, value):
+        """Add a sample, replacing the oldest once the ring is full."""
+        self._samples[self._count % len(self._samples)] = value
+        self._count = self._count + 1
+
+    def summary(self):
+        """Return a dict of the sample count, and mean, 50th, 90th, 99th
+        percentile and max over the samples in the ring.
+        """
+        samples = self._samples[:min(self._count, len(self._samples))]
+        if len(samples) == 0:
+            return {'count': 0}
+        p50, p90, p99 = numpy.percentile(samples, [50, 90, 99])
+        return {
+            'count': self._count,
+            'mean': float(samples.mean()),
+            'p50': float(p50),
+            'p90': float(p90),
+            'p99': float(p99),
+            'max': float(samples.max()),
+        }
+
+
+class Metrics(object):
+    def __init__(self):
+        """Collection of named rolling histograms and counters."""
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._inputs = {}  # input source: perf_counter() of its event
+        self._log_thread = None
+        self._log_stop = threading.Event()
+
+    def enable(self, enabled=True):
+        """Start (or stop) collecting metrics."""
+        self.enabled = enabled
+
+    def reset(self):
+        """Forget everything collected so far."""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            self._inputs = {}
+
+    def record(self, name, seconds):
+        """Add a time, in seconds, to the named histogram (kept in ms)."""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, RollingHistogram())
+        histogram.add(seconds * 1000.0)
+
+    def count(self, name, n=1):
+        """Add n to the named counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def markInput(self, source):
+        """Note that an input event just happened, to time how long until
+        the pixels show its effect.
+        source: str, such as 'button_red' or 'osc_erupt'
+        """
+        if self.enabled:
+            with self._lock:
+                self._inputs.setdefault(source, time.perf_counter())
+
+    def frameShown(self, shown_time=None):
+        """Note that a frame went out to the pixels, just now or at the
+        time.perf_counter() time shown_time.
+        """
+        if self._inputs:
+            now = time.perf_counter() if shown_time is None else shown_time
+            with self._lock:
+                inputs = self._inputs
+                self._inputs = {}
+            for source, event_time in inputs.items():
+                self.record('input.' + source, now - event_time)
+
+    def snapshot(self):
+        """Return a dict of everything collected:
+        {'enabled': bool, 'histograms': {name: summary}, 'counters': {name: int}}
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        return {
+            'enabled': self.enabled,
+            'histograms': {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            'counters': counters,
+        }
+
+    def formatLine(self):
+        """Return a one-line summary of the snapshot, for logging."""
+        snapshot = self.snapshot()
+        parts = []
+        for name, summary in snapshot['histograms'].items():
+            if summary['count'] > 0:
+                parts.append('{0} p50 {1:.2f} p99 {2:.2f} ms'.format(name, summary['p50'], summary['p99']))
+        for name, value in sorted(snapshot['counters'].items()):
+            parts.append('{0} {1}'.format(name, value))
+        return 'stats: ' + ', '.join(parts)
+
+    def startLogging(self, seconds=STATS_LOG_SECONDS):
+        """Print formatLine() every so many seconds, from its own thread."""
+        if self._log_thread is not None:
+            return  # already logging
+        self._log_stop.clear()
+
+        def log():
+            while not self._log_stop.wait(seconds):
+                print(self.formatLine())
+
+        self._log_thread = threading.Thread(target=log, name='MetricsLog')
+        self._log_thread.daemon = True
+        self._log_thread.start()
+
+    def stopLogging(self):
+        """Stop the periodic log line."""
+        if self._log_thread is not None:
+            self._log_stop.set()
+            self._log_thread.join()
+            self._log_thread = None
+
+
+# The one set of metrics for the whole process
+METRICS = Metrics()
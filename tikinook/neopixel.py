@@ -1,6 +1,19 @@
 # Adafruit NeoPixel library port to the rpi_ws281x library.
 # Author: Tony DiCola (tony@tonydicola.com), Jeremy Garff (jer@jers.net)
-import _rpi_ws281x as ws
+import ctypes
+
+import numpy
+
+import hardware
+import pixelcolor
+
+# _rpi_ws281x, or its simulator stand-in
+ws = hardware.ws281x()
+
+# Order the strand takes red, green and blue in. After I hooked things back
+# up on 2016-03-26, the NeoPixels displayed with R and G swapped, so green
+# goes first.
+COLOR_ORDER = 'GRB'
 
 
 def Color(red, green, blue):
@@ -14,20 +27,51 @@ def Color(red, green, blue):
 class _LED_Data(object):
     """Wrapper class which makes a SWIG LED color data array look and feel like
     a Python list of integers.
+
+    Once map() succeeds, array is a numpy uint32 view straight onto the
+    channel's LED memory, and reads and writes go through it, whole slices
+    at a time. Until then (or if the ws281x module can't give out the
+    memory's address), each LED is a separate ws2811_led_get/set call.
     """
 
     def __init__(self, channel, size):
         self.size = size
         self.channel = channel
+        self.array = None
+
+    def map(self):
+        """Map the channel's LED memory as a numpy uint32 array. Only valid
+        after ws2811_init, which allocates it, and until ws2811_fini, which
+        frees it. Return True if it is mapped.
+        """
+        leds_get = getattr(ws, 'ws2811_channel_t_leds_get', None)
+        if leds_get is None or self.size == 0:
+            return False
+        try:
+            address = int(leds_get(self.channel))
+        except (TypeError, ValueError):
+            return False  # no address to be had from this pointer
+        if address == 0:
+            return False
+        self.array = numpy.ctypeslib.as_array((ctypes.c_uint32 * self.size).from_address(address))
+        return True
+
+    def unmap(self):
+        """Stop using the channel's LED memory, before it is freed."""
+        self.array = None
 
     def __getitem__(self, pos):
         """Return the 24-bit RGB color value at the provided position or slice
         of positions.
         """
+        if self.array is not None:
+            if isinstance(pos, slice):
+                return self.array[pos].tolist()
+            return int(self.array[pos])
         # Handle if a slice of positions are passed in by grabbing all the values
         # and returning them in a list.
         if isinstance(pos, slice):
-            return [ws.ws2811_led_get(self.channel, n) for n in range(pos.indices(self.size))]
+            return [ws.ws2811_led_get(self.channel, n) for n in range(*pos.indices(self.size))]
         # Else assume the passed in value is a number to the position.
         else:
             return ws.ws2811_led_get(self.channel, pos)
@@ -36,13 +80,16 @@ class _LED_Data(object):
         """Set the 24-bit RGB color value at the provided position or slice of
         positions.
         """
+        if self.array is not None:
+            self.array[pos] = value
+            return
         # debug
         # print("pos: {}, value: {}", pos, value)
         # Handle if a slice of positions are passed in by setting the appropriate
         # LED data values to the provided values.
         if isinstance(pos, slice):
             index = 0
-            for n in range(pos.indices(self.size)):
+            for n in range(*pos.indices(self.size)):
                 ws.ws2811_led_set(self.channel, n, value[index])
                 index += 1
         # Else assume the passed in value is a number to the position.
@@ -54,18 +101,118 @@ class _LED_Data(object):
             # return ws.ws2811_led_set(self.channel, pos.item(), value.item())
 
 
-class Adafruit_NeoPixel(object):
-    def __init__(self, num, pin, freq_hz=800000, dma=5, invert=False, brightness=255, channel=0):
+class _ChannelPixels(object):
+    """Pixel access for one PWM channel of a ws2811_t: its _channel,
+    _led_data and _color_order. Shared by Adafruit_NeoPixel, for the channel
+    it was created with, and NeoPixelChannel, for the other one.
+    """
+
+    def _setupChannel(self, leds, channel, num, pin, invert, brightness, color_order):
+        """Configure channel number channel of the ws2811_t leds."""
+        self._color_order = color_order
+        self._red_shift, self._green_shift, self._blue_shift = pixelcolor.PACK_SHIFTS[color_order]
+        self._channel = ws.ws2811_channel_get(leds, channel)
+        ws.ws2811_channel_t_count_set(self._channel, num)
+        ws.ws2811_channel_t_gpionum_set(self._channel, pin)
+        ws.ws2811_channel_t_invert_set(self._channel, 0 if not invert else 1)
+        ws.ws2811_channel_t_brightness_set(self._channel, brightness)
+
+        # Grab the led data array.
+        self._led_data = _LED_Data(self._channel, num)
+
+    def setPixelColor(self, n, color):
+        """Set LED at position n to the provided 24-bit color value (in RGB order).
+        """
+        # Repack in the strand's color order
+        red = (color >> 16) & 0xFF
+        green = (color >> 8) & 0xFF
+        blue = color & 0xFF
+        self._led_data[n] = (red << self._red_shift) | (green << self._green_shift) | (blue << self._blue_shift)
+
+    def setPixelColorRGB(self, n, red, green, blue):
+        """Set LED at position n to the provided red, green, and blue color.
+        Each color component should be a value from 0 to 255 (where 0 is the
+        lowest intensity and 255 is the highest intensity).
+        """
+        self.setPixelColor(n, Color(red, green, blue))
+
+    def setPixels(self, colors):
+        """Set LEDs from an array of [R, G, B] rows, starting at pixel 0."""
+        self.setRange(0, len(colors), colors)
+
+    def setRange(self, start, stop, colors):
+        """Set LEDs from start up to (not including) stop, from either one
+        [R, G, B] color for the whole range, or an array of (stop - start)
+        [R, G, B] rows. Colors are packed to 24-bit values all at once, and
+        written in one slice of the LED memory once begin() has mapped it.
+        """
+        clipped = pixelcolor.clipRange(start, stop, colors, self.numPixels())
+        if clipped is None:
+            return  # outside the strand length; throw it away
+        start, stop, colors = clipped
+        packed = pixelcolor.pack(colors, self._color_order)
+        if self._led_data.array is not None:
+            self._led_data.array[start:stop] = packed
+        else:
+            self._led_data[start:stop] = numpy.broadcast_to(packed, (stop - start,)).tolist()
+
+    def setPixelsAt(self, indices, colors):
+        """Set the LEDs at an array of pixel positions, from either one
+        [R, G, B] color for every position, or an array of [R, G, B] rows.
+        """
+        indices, colors = pixelcolor.clipIndices(indices, colors, self.numPixels())
+        packed = pixelcolor.pack(colors, self._color_order)
+        if self._led_data.array is not None:
+            self._led_data.array[indices] = packed
+            return
+        packed = numpy.broadcast_to(packed, (len(indices),))
+        for n, color in zip(indices.tolist(), packed.tolist()):
+            self._led_data[n] = color
+
+    def fill(self, color):
+        """Set all LEDs to the provided [R, G, B] color."""
+        self.setRange(0, self.numPixels(), color)
+
+    def setBrightness(self, brightness):
+        """Scale each LED in the buffer by the provided brightness.  A brightness
+        of 0 is the darkest and 255 is the brightest.
+        """
+        ws.ws2811_channel_t_brightness_set(self._channel, brightness)
+
+    def getPixels(self):
+        """Return an object which allows access to the LED display data as if 
+        it were a sequence of 24-bit RGB values.
+        """
+        return self._led_data
+
+    def numPixels(self):
+        """Return the number of pixels in the display."""
+        return ws.ws2811_channel_t_count_get(self._channel)
+
+    def getPixelColor(self, n):
+        """Get the 24-bit RGB color value for the LED at position n."""
+        return self._led_data[n]
+
+
+class Adafruit_NeoPixel(_ChannelPixels):
+    def __init__(self, num, pin, freq_hz=800000, dma=5, invert=False, brightness=255, channel=0,
+                 color_order=COLOR_ORDER):
         """Class to represent a NeoPixel/WS281x LED display.  Num should be the
         number of pixels in the display, and pin should be the GPIO pin connected
         to the display signal line (must be a PWM pin like 18!).  Optional
         parameters are freq, the frequency of the display signal in hertz (default
         800khz), dma, the DMA channel to use (default 5), invert, a boolean
-        specifying if the signal line should be inverted (default False), and
-        channel, the PWM channel to use (defaults to 0).
+        specifying if the signal line should be inverted (default False),
+        channel, the PWM channel to use (defaults to 0), and color_order, the
+        order the strand takes red, green and blue in (default COLOR_ORDER).
+        Call addChannel() to drive a second display from the other PWM channel.
         """
         # Create ws2811_t structure and fill in parameters.
         self._leds = ws.new_ws2811_t()
+        self._initialized = False
+
+        # NeoPixelChannel on the other PWM channel, once added
+        self._second_channel = None
 
         # Initialize the channels to zero
         for channum in range(2):
@@ -76,79 +223,88 @@ class Adafruit_NeoPixel(object):
             ws.ws2811_channel_t_brightness_set(chan, 0)
 
         # Initialize the channel in use
-        self._channel = ws.ws2811_channel_get(self._leds, channel)
-        ws.ws2811_channel_t_count_set(self._channel, num)
-        ws.ws2811_channel_t_gpionum_set(self._channel, pin)
-        ws.ws2811_channel_t_invert_set(self._channel, 0 if not invert else 1)
-        ws.ws2811_channel_t_brightness_set(self._channel, brightness)
+        self._channel_number = channel
+        self._setupChannel(self._leds, channel, num, pin, invert, brightness, color_order)
 
         # Initialize the controller
         ws.ws2811_t_freq_set(self._leds, freq_hz)
         ws.ws2811_t_dmanum_set(self._leds, dma)
 
-        # Grab the led data array.
-        self._led_data = _LED_Data(self._channel, num)
-
     def __del__(self):
         # Clean up memory used by the library when not needed anymore.
         if self._leds is not None:
+            self._led_data.unmap()
+            if self._second_channel is not None:
+                self._second_channel._led_data.unmap()
             ws.ws2811_fini(self._leds)
             ws.delete_ws2811_t(self._leds)
             self._leds = None
             self._channel = None
             # Note that ws2811_fini will free the memory used by led_data internally.
 
+    def addChannel(self, num, pin, invert=False, brightness=255, color_order=COLOR_ORDER):
+        """Set up the controller's other PWM channel (channel 1 if this one is
+        0, such as on pin 13) to drive a second display of num pixels, and
+        return it as a NeoPixelChannel. Both channels go out at the same time,
+        from the same ws2811_render call, so splitting one long run across
+        the two about halves its time on the wire. Call before begin().
+        """
+        if self._second_channel is not None:
+            raise RuntimeError('Both PWM channels are already in use')
+        if self._initialized:
+            raise RuntimeError('Add channels before calling begin()')
+        self._second_channel = NeoPixelChannel(self, 1 - self._channel_number, num, pin, invert, brightness,
+                                               color_order)
+        return self._second_channel
+
+    def renderOwner(self):
+        """Return the object whose show() sends this display out: the
+        controller, shared with a NeoPixelChannel from addChannel().
+        """
+        return self
+
     def begin(self):
         """Initialize library, must be called once before other functions are
-        called.
+        called. Calling it again (as each channel's begin() does) does nothing.
         """
+        if self._initialized:
+            return
         resp = ws.ws2811_init(self._leds)
         if resp != 0:
             raise RuntimeError('ws2811_init failed with code {0}'.format(resp))
+        self._initialized = True
+        # The LED memory exists now, so write to it directly if we can
+        self._led_data.map()
+        if self._second_channel is not None:
+            self._second_channel._led_data.map()
 
     def show(self):
-        """Update the display with the data from the LED buffer."""
+        """Update the display (and any second channel's) with the data from
+        the LED buffers.
+        """
         resp = ws.ws2811_render(self._leds)
         if resp != 0:
             raise RuntimeError('ws2811_render failed with code {0}'.format(resp))
 
-    def setPixelColor(self, n, color):
-        """Set LED at position n to the provided 24-bit color value (in RGB order).
-        """
-        # FIXME: I don't know what the hell is going on, but after I hooked
-        # things back up on 2016-03-26, the NeoPixels are now displaying with 
-        # R and G swapped. Temp fix here:
-        red = (color >> 16) & 0xFF
-        green = (color >> 8) & 0xFF
-        blue = color & 0xFF
-        color = (green << 16) | (red << 8) | blue
-
-        # Now back to what it should be:
-        self._led_data[n] = color
 
-    def setPixelColorRGB(self, n, red, green, blue):
-        """Set LED at position n to the provided red, green, and blue color.
-        Each color component should be a value from 0 to 255 (where 0 is the
-        lowest intensity and 255 is the highest intensity).
+class NeoPixelChannel(_ChannelPixels):
+    def __init__(self, controller, channel, num, pin, invert, brightness, color_order):
+        """The second PWM channel of an Adafruit_NeoPixel controller, as a
+        display of its own. Create it with Adafruit_NeoPixel.addChannel().
+        It shares the controller's ws2811_t, so show() sends out both
+        channels, in one render.
         """
-        self.setPixelColor(n, Color(red, green, blue))
-
-    def setBrightness(self, brightness):
-        """Scale each LED in the buffer by the provided brightness.  A brightness
-        of 0 is the darkest and 255 is the brightest.
-        """
-        ws.ws2811_channel_t_brightness_set(self._channel, brightness)
+        self._controller = controller
+        self._setupChannel(controller._leds, channel, num, pin, invert, brightness, color_order)
 
-    def getPixels(self):
-        """Return an object which allows access to the LED display data as if 
-        it were a sequence of 24-bit RGB values.
-        """
-        return self._led_data
+    def renderOwner(self):
+        """Return the controller, whose show() sends this channel out."""
+        return self._controller
 
-    def numPixels(self):
-        """Return the number of pixels in the display."""
-        return ws.ws2811_channel_t_count_get(self._channel)
+    def begin(self):
+        """Initialize the controller, if it isn't already."""
+        self._controller.begin()
 
-    def getPixelColor(self, n):
-        """Get the 24-bit RGB color value for the LED at position n."""
-        return self._led_data[n]
+    def show(self):
+        """Update both of the controller's channels."""
+        self._controller.show()
@@ -4,9 +4,15 @@
 Code specific to controlling the lights and other display events
 in the tiki nook for Kilauea Cove.
 
-Must be run from the current directory, else the animation will not load, as:
+Run as:
     sudo python nook_controller.py
 
+Or, off the Pi, with simulated pixels and GPIO (see hardware.py):
+    TIKINOOK_BACKEND=simulator python3 nook_controller.py --ip 127.0.0.1
+
+Add --stats SECONDS to collect render metrics and print them every so often
+(see metrics.py). OSC /stats replies with them as JSON either way.
+
 Author: Mark Boszko (boszko+kilaueacove@gmail.com)
 
 License:
@@ -21,18 +27,30 @@ Version History:
 """
 
 import argparse
-import numpy
-import RPi.GPIO as GPIO
+import itertools
+import json
+import os
 import time
 import threading
 
 from pythonosc import dispatcher
 from pythonosc import osc_server
+from pythonosc import udp_client
 
+import hardware
+from compositor import Compositor
+from metrics import METRICS
 import neopixel
 import paleopixel
+import pixelcolor
+from renderloop import RenderLoop
+from scenes import Scene
+from scheduler import EffectScheduler
 from superpixel import *
 
+# RPi.GPIO, or its simulator stand-in
+GPIO = hardware.gpio()
+
 # ------------------------------
 # GPIO setup
 # ------------------------------
@@ -45,15 +63,17 @@ BUTTON_RED_IN = 25
 TOGGLE_RED_IN = 16
 SMOKE_CONTROL = 21
 
-# Set up GPIO pins
 
-GPIO.setmode(GPIO.BCM)
+def setup_gpio():
+    """Set up GPIO pins"""
+    GPIO.setmode(GPIO.BCM)
+
+    GPIO.setup(BUTTON_WHITE_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    GPIO.setup(BUTTON_AMBER_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    GPIO.setup(BUTTON_RED_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    GPIO.setup(TOGGLE_RED_IN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    GPIO.setup(SMOKE_CONTROL, GPIO.OUT)
 
-GPIO.setup(BUTTON_WHITE_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(BUTTON_AMBER_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(BUTTON_RED_IN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(TOGGLE_RED_IN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(SMOKE_CONTROL, GPIO.OUT)
 
 # ------------------------------
 # LED setup
@@ -67,18 +87,22 @@ AMBER_LED = 1
 RED_LED = 2
 NEOPIXEL_COUNT = 271  # Number of NeoPixels in the super_strand
 NEOPIXEL_PIN = 18  # GPIO pin connected to the pixels (must support PWM!)
+# To halve the NeoPixels' time on the wire, the run can be split, with the
+# last NEOPIXEL_SPLIT_COUNT pixels fed from the second PWM channel. Both
+# halves go out in the same render, and keep their pixel numbering.
+NEOPIXEL_SPLIT_COUNT = 0  # NeoPixels on the second channel; 0 for one run
+NEOPIXEL_SPLIT_PIN = 13  # GPIO pin for the second channel (PWM1)
 PALEOPIXEL_COUNT = 50  # Number of PaleoPixels in the super_strand
 
 # Create pixel strands with appropriate configuration.
-neopixel_strand = neopixel.Adafruit_NeoPixel(NEOPIXEL_COUNT, NEOPIXEL_PIN)
+neopixel_strand = neopixel.Adafruit_NeoPixel(NEOPIXEL_COUNT - NEOPIXEL_SPLIT_COUNT, NEOPIXEL_PIN)
+neopixel_strands = [neopixel_strand]
+if NEOPIXEL_SPLIT_COUNT > 0:
+    neopixel_strands.append(neopixel_strand.addChannel(NEOPIXEL_SPLIT_COUNT, NEOPIXEL_SPLIT_PIN))
 paleopixel_strand = paleopixel.PaleoPixel(PALEOPIXEL_COUNT)
 
 # Combine them into one SuperPixel super_strand
-super_strand = SuperPixel(neopixel_strand, paleopixel_strand)
-
-# Intialize the SuperPixel super_strand (must be called once, before other
-# functions, if the SuperPixel super_strand contains any NeoPixel sub-strands)
-super_strand.begin()
+super_strand = SuperPixel(*(neopixel_strands + [paleopixel_strand]))
 
 # Set up grid segments
 grid = PixelGrid(super_strand, (311, 10), (310, -10), (291, 10), (290, -10), (271, 10), (246, -41), (165, 41), (164, -41),
@@ -89,37 +113,217 @@ shelf_back_grid = PixelGrid(super_strand, (165, 41), (83, 41), (3, 39))
 shelf_front_grid = PixelGrid(super_strand, (246, -41), (164, -41), (82, -41))
 ring_grid = PixelGrid(super_strand, (247, 24))
 
+# Output correction, per strand. The scene colors below were picked by eye
+# without gamma correction, so these stay at 1.0 until they're re-picked;
+# around 2.2 suits both strands.
+NEOPIXEL_GAMMA = 1.0
+PALEOPIXEL_GAMMA = 1.0
+for strand_index in range(len(neopixel_strands)):
+    super_strand.setStrandOutput(strand_index, gamma=NEOPIXEL_GAMMA)
+super_strand.setStrandOutput(len(neopixel_strands), gamma=PALEOPIXEL_GAMMA)
+
+# Dimmer zones, for OSC /brightness
+DIMMER_ZONES = {
+    'buttons': button_grid,
+    'rattan': rattan_grid,
+    'shelf_back': shelf_back_grid,
+    'shelf_front': shelf_front_grid,
+    'ring': ring_grid,
+}
+for zone_name, zone_grid in DIMMER_ZONES.items():
+    super_strand.addZone(zone_name, zone_grid.pixelIndices())
+
+# All frames go out to the pixels from the render thread, at a fixed rate;
+# everything else just draws into super_strand
+render_loop = RenderLoop(super_strand)
+
+# Runs the light shows on the render thread, one at a time; a button press
+# preempts whatever is running within a frame
+scheduler = EffectScheduler(render_loop)
+
+
+# ------------------------------
+# Layers
+# ------------------------------
+
+# The effects draw on layers, which the render thread flattens onto
+# super_strand (after the scheduler has stepped, each frame), so the idle
+# scene, the button lights and the eruption can all run at once. Bottom up:
+#   ambience - the idle scenes
+#   eruption - the volcano show, over the whole strand; transparent when
+#              there's no show
+#   buttons  - the control box button lights
+compositor = Compositor(super_strand, render_loop)
+ambience_layer = compositor.addLayer('ambience')
+eruption_layer = compositor.addLayer('eruption', opacity=0.0)
+button_layer = compositor.addLayer('buttons', button_grid)
+
+# The grids, on the eruption layer
+eruption_rattan_grid = rattan_grid.onStrand(eruption_layer)
+eruption_shelf_back_grid = shelf_back_grid.onStrand(eruption_layer)
+eruption_shelf_front_grid = shelf_front_grid.onStrand(eruption_layer)
+eruption_ring_grid = ring_grid.onStrand(eruption_layer)
+
 
 # ------------------------------
 # Eruption animation setup
 # ------------------------------
 
-# load the animation
-volcano_animation = PixelPlayer(rattan_grid, '/home/pi/kilaueacove/tikinook/animation/volcano-v05-16x16.mov')
+# load the animation, from next to this file
+ANIMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'animation')
+volcano_animation = PixelPlayer(eruption_rattan_grid, os.path.join(ANIMATION_DIR, 'volcano-v05-16x16.mov'))
+
+
+# ------------------------------
+# Scenes
+# ------------------------------
+
+# Each is compiled into one frame the first time it's used, so recalling or
+# fading to it is a single write. They're drawn on the ambience layer; the
+# buttons are lit on their own layer, above.
+
+# Pretty colors for the default idle scene
+AMBER_SCENE = Scene('amber')
+AMBER_SCENE.setRow(ring_grid, 0, Color(0, 0, 0))
+AMBER_SCENE.setRow(rattan_grid, 0, Color(250, 127, 0))
+AMBER_SCENE.setRow(rattan_grid, 1, Color(128, 50, 0))
+AMBER_SCENE.setRow(rattan_grid, 2, Color(64, 10, 0))
+AMBER_SCENE.setRow(rattan_grid, 3, Color(0, 90, 75))
+AMBER_SCENE.setRow(rattan_grid, 4, Color(0, 0, 100))
+AMBER_SCENE.setAll(shelf_back_grid, Color(0, 2, 4))
+AMBER_SCENE.setAll(shelf_front_grid, Color(50, 20, 10))
+
+# The amber scene, except white under the bottom shelf, for mixing drinks
+WHITE_SCENE = Scene('white', base=AMBER_SCENE)
+WHITE_SCENE.setRow(shelf_back_grid, 2, Color(255, 160, 64))  # a more "natural" white
 
 
 # ------------------------------
 # Globals
 # ------------------------------
 
-# Make these globals so threaded button functions can address it
-global WHITE_TIMEOUT
-WHITE_TIMEOUT = None
-# Length in seconds
+# Length in seconds of the white light, before it goes back to amber
 WHITE_TIMEOUT_LENGTH = 300
 
+# Length in seconds of the cross-fade when one effect interrupts another
+CROSSFADE_LENGTH = 0.5
+
 global IS_TOGGLE
 IS_TOGGLE = False
 
 
 # ------------------------------
-# Callback methods
+# Effects
 # ------------------------------
 
-# FIXME: animation functions need to know when another function has been called
-#        and cancel any further animation in the current function.
+# These are generators, run by the scheduler: each step draws, then yields
+# None to wait for the next frame, or a number of seconds to wait.
+
+def light_button(led):
+    """Light one of the control box buttons, and dim the others."""
+    button_layer.grid().setRowColorRGB(0, 16, 16, 16)
+    button_layer.grid().setPixelColorRGB(led, 0, 64, 64, 64)
+
+
+def crossfade_to(scene, seconds=CROSSFADE_LENGTH):
+    """Cross-fade the ambience layer from whatever it shows now to a scene,
+    while fading out anything left on the eruption layer.
+    """
+    fades = [scene.fadeSteps(ambience_layer, seconds), eruption_layer.fadeOpacitySteps(0.0, seconds)]
+    for steps in itertools.zip_longest(*fades):
+        yield None
+
+
+def white_effect():
+    """White light for mixing drinks, then back to amber after
+    WHITE_TIMEOUT_LENGTH seconds.
+    """
+    light_button(WHITE_LED)
+    yield from crossfade_to(WHITE_SCENE)
+    yield WHITE_TIMEOUT_LENGTH
+    yield from amber_effect()
+
+
+def amber_effect():
+    """Default idle mode.
+
+    TODO: subtle animation
+    """
+    light_button(AMBER_LED)
+    yield from crossfade_to(AMBER_SCENE)
 
-# TODO: smooth transitions between animation functions
+
+def volcano_effect():
+    """Volcano Show: a synchronized light, sound, and smoke show, on the
+    eruption layer, over the idle scene.
+    TODO: final lighting sequence
+    TODO: Sound
+    """
+    try:
+        # Start the show; set color of control box buttons
+        light_button(RED_LED)
+
+        # TODO: Slower fade out, bottom to top
+        # Blackout, by fading in the eruption layer, black
+        eruption_layer.clear()
+        yield from eruption_layer.fadeOpacitySteps(1.0, seconds=3)
+
+        # Smoke starts
+        GPIO.output(SMOKE_CONTROL, GPIO.HIGH)
+
+        # TODO, top row slower shrink in from edges, turn red
+        # Highlight the volcano
+        y = 0  # top row
+        eruption_shelf_front_grid.setAllColorRGB(0, 0, 0)
+        eruption_shelf_front_grid.setPixelColorRGB(20, y, 255, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(0, 4, 0, 0)
+        yield 0.01
+        eruption_shelf_front_grid.setPixelColorRGB(19, y, 125, 0, 0)
+        eruption_shelf_front_grid.setPixelColorRGB(21, y, 128, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(0, 16, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(1, 4, 0, 0)
+        yield 0.01
+        eruption_shelf_front_grid.setPixelColorRGB(18, y, 64, 0, 0)
+        eruption_shelf_front_grid.setPixelColorRGB(22, y, 64, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(0, 64, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(1, 16, 0, 0)
+        eruption_shelf_back_grid.setRowColorRGB(2, 4, 0, 0)
+        yield 10
+
+        # Turn the ring red to highlight smoke
+        # TODO: make this fluctuate red/orage/yellow during eruption sequence
+        eruption_ring_grid.setRowColorRGB(0, 255, 0, 0)
+        yield 4
+
+        # Play animation, at the clip's own frame rate
+        yield from volcano_animation.playSteps()
+
+        # Smoke off
+        GPIO.output(SMOKE_CONTROL, GPIO.LOW)
+        yield 3
+
+        # Fade to black
+        yield from eruption_layer.fadeSteps(pixelcolor.newFrame(eruption_layer.numPixels()), seconds=1)
+        yield 3
+
+        # Fade up to Amber, by fading the eruption layer back out over the
+        # idle scene
+        light_button(AMBER_LED)
+        AMBER_SCENE.recall(ambience_layer)
+        yield from eruption_layer.fadeOpacitySteps(0.0, seconds=2)
+    finally:
+        # Also runs if another button interrupts the show; its cross-fade
+        # fades the eruption layer out
+        GPIO.output(SMOKE_CONTROL, GPIO.LOW)
+
+
+# ------------------------------
+# Callback methods
+# ------------------------------
+
+# These only schedule an effect, and return right away, so the GPIO event
+# thread is never blocked. The effect starts on the next frame, cancelling
+# any effect already running.
 
 # Set up our GPIO callbacks
 def button_white(channel='default'):
@@ -129,56 +333,17 @@ def button_white(channel='default'):
     """
     print("button_white()")
     print("channel: ", channel)
-
-    # Cancel the timer for the white light
-    global WHITE_TIMEOUT
-    if (WHITE_TIMEOUT is not None):
-        WHITE_TIMEOUT.cancel()
-
-    # Set all row colors the same as button_amber(), except
-    # get the row underneath the bottom shelf, and show white
-    button_grid.setRowColorRGB(0, 16, 16, 16)
-    button_grid.setPixelColorRGB(WHITE_LED, 0, 64, 64, 64)
-    button_grid.show()
-    ring_grid.setRowColorRGB(0, 0, 0, 0)
-    ring_grid.show()
-    shelf_back_grid.setRowColorRGB(2, 255, 160, 64)  # a more "natural" white
-    shelf_back_grid.show()
-
-    # Start a timer to go back to amber after WHITE_TIMEOUT_LENGTH
-    WHITE_TIMEOUT = threading.Timer(WHITE_TIMEOUT_LENGTH, button_amber, ['WHITE_TIMEOUT'])
-    WHITE_TIMEOUT.start()
+    METRICS.markInput('button_white')
+    scheduler.run(white_effect())
 
 
 def button_amber(channel='default'):
     """Default idle mode.
-    
-    TODO: subtle animation
     """
     print("button_amber()")
     print("channel: ", channel)
-
-    # Cancel the timer for the white light
-    global WHITE_TIMEOUT
-    if (WHITE_TIMEOUT is not None):
-        WHITE_TIMEOUT.cancel()
-
-    # Set pretty colors
-    button_grid.setRowColorRGB(0, 16, 16, 16)
-    button_grid.setPixelColorRGB(AMBER_LED, 0, 64, 64, 64)
-    button_grid.show()
-    ring_grid.setRowColorRGB(0, 0, 0, 0)
-    ring_grid.show()
-    rattan_grid.setRowColorRGB(0, 250, 127, 0)
-    rattan_grid.setRowColorRGB(1, 128, 50, 0)
-    rattan_grid.setRowColorRGB(2, 64, 10, 0)
-    rattan_grid.setRowColorRGB(3, 0, 90, 75)
-    rattan_grid.setRowColorRGB(4, 0, 0, 100)
-    shelf_back_grid.setAllColorRGB(0, 2, 4)
-    shelf_front_grid.setAllColorRGB(50, 20, 10)
-    rattan_grid.show()
-    shelf_back_grid.show()
-    shelf_front_grid.show()
+    METRICS.markInput('button_amber')
+    scheduler.run(amber_effect())
 
 
 def toggle_red_on(channel='default'):
@@ -211,10 +376,6 @@ def button_red(channel='default'):
     """Volcano Show
     
     Requires Volcano Safety Toggle to be on.
-    Starts a synchronized light, sound, and smoke show.
-    TODO: final lighting sequence
-    TODO: Sound
-    TODO: Smoke
     """
     print("button_red")
     print("channel: ", channel)
@@ -222,122 +383,14 @@ def button_red(channel='default'):
     global IS_TOGGLE
     print("IS_TOGGLE: ", IS_TOGGLE)
     if (IS_TOGGLE):
-        # Cancel the timer for the white light, so it doesn't interrupt the show
-        global WHITE_TIMEOUT
-        if (WHITE_TIMEOUT is not None):
-            WHITE_TIMEOUT.cancel()
-
         # This (should) prevent another volcano run
         #     until the toggle is physically cycled first
         IS_TOGGLE = False
 
-        # Start the show; set color of control box buttons
-        button_grid.setRowColorRGB(0, 16, 16, 16)
-        button_grid.setPixelColorRGB(RED_LED, 0, 64, 64, 64)
-        button_grid.show()
-
-        # TODO: Slower fade out, bottom to top
-        # Blackout
-        # grid.setAllColorRGB(0, 0, 0)
-        # grid.show()
-        pixel_count = len(super_strand.getPixels())
-        new_colors = numpy.zeros((pixel_count, 3), dtype=numpy.int)
-        super_strand.fade_to_colors(new_colors=new_colors, seconds=3)
-
-        # Smoke starts
-        GPIO.output(SMOKE_CONTROL, GPIO.HIGH)
-
-        # TODO, top row slower shrink in from edges, turn red
-        # Highlight the volcano
-        y = 0  # top row
-        shelf_front_grid.setAllColorRGB(0, 0, 0)
-        shelf_front_grid.setPixelColorRGB(20, y, 255, 0, 0)
-        shelf_front_grid.show()
-        shelf_back_grid.setRowColorRGB(0, 4, 0, 0)
-        shelf_back_grid.show()
-        time.sleep(0.01)
-        shelf_front_grid.setPixelColorRGB(19, y, 125, 0, 0)
-        shelf_front_grid.setPixelColorRGB(21, y, 128, 0, 0)
-        shelf_front_grid.show()
-        shelf_back_grid.setRowColorRGB(0, 16, 0, 0)
-        shelf_back_grid.setRowColorRGB(1, 4, 0, 0)
-        shelf_back_grid.show()
-        time.sleep(0.01)
-        shelf_front_grid.setPixelColorRGB(18, y, 64, 0, 0)
-        shelf_front_grid.setPixelColorRGB(22, y, 64, 0, 0)
-        shelf_front_grid.show()
-        shelf_back_grid.setRowColorRGB(0, 64, 0, 0)
-        shelf_back_grid.setRowColorRGB(1, 16, 0, 0)
-        shelf_back_grid.setRowColorRGB(2, 4, 0, 0)
-        shelf_back_grid.show()
-        time.sleep(10)
-
-        # Turn the ring red to highlight smoke
-        # TODO: make this fluctuate red/orage/yellow during eruption sequence
-        ring_grid.setRowColorRGB(0, 255, 0, 0)
-        ring_grid.show()
-        time.sleep(4)
-
-        # Play animation
-        # FIXME: Slow this down!
-        volcano_animation.play(delay=0.013)
-
-        # Smoke off
-        GPIO.output(SMOKE_CONTROL, GPIO.LOW)
-        time.sleep(3)
-
-        # Fade to black
-        new_colors = numpy.zeros((pixel_count, 3), dtype=numpy.int)
-        super_strand.fade_to_colors(new_colors=new_colors, seconds=1)
-        time.sleep(3)
-
-        # Fade up to Amber
-        # Start with black
-        amber_colors = numpy.zeros((pixel_count, 3), dtype=numpy.int)
-        # Assign Amber colors
-        amber_colors[WHITE_LED] = [16, 16, 16]
-        amber_colors[AMBER_LED] = [64, 64, 64]
-        amber_colors[RED_LED] = [16, 16, 16]
-        # Ring is already black, no need to change
-        for index in range(311, 321):
-            # Rattan row 0
-            amber_colors[index] = [250, 127, 0]
-        for index in range(301, 311):
-            # Rattan row 1
-            amber_colors[index] = [128, 50, 0]
-        for index in range(291, 301):
-            # Rattan row 2
-            amber_colors[index] = [64, 10, 0]
-        for index in range(281, 291):
-            # Rattan row 3
-            amber_colors[index] = [0, 90, 75]
-        for index in range(271, 281):
-            # Rattan row 4
-            amber_colors[index] = [0, 0, 100]
-        for index in range(165, 206):
-            # Shelf Back row 0
-            amber_colors[index] = [0, 2, 4]
-        for index in range(83, 124):
-            # Shelf Back row 1
-            amber_colors[index] = [0, 2, 4]
-        for index in range(3, 42):
-            # Shelf Back row 2
-            amber_colors[index] = [0, 2, 4]
-        for index in range(206, 247):
-            # Shelf Front row 0
-            amber_colors[index] = [50, 20, 10]
-        for index in range(124, 165):
-            # Shelf Front row 1
-            amber_colors[index] = [50, 20, 10]
-        for index in range(42, 83):
-            # Shelf Front row 2
-            amber_colors[index] = [50, 20, 10]
-
-        # Fade
-        super_strand.fade_to_colors(new_colors=amber_colors, seconds=2)
-
-        # Comment out so I can examine the fade results
-        button_amber(channel='volcano_end')
+        if channel != 'OSC':
+            METRICS.markInput('button_red')
+        # Also cancels the white light timeout, so it doesn't interrupt
+        scheduler.run(volcano_effect())
 
 
 def erupt_handler(unused_addr, args, erupt):
@@ -346,11 +399,51 @@ def erupt_handler(unused_addr, args, erupt):
     print("unused_addr:", unused_addr)
     print("args:", args)
     print("erupt:", erupt)
+    METRICS.markInput('osc_erupt')
     global IS_TOGGLE
     IS_TOGGLE = True
     button_red(channel='OSC')
 
 
+def brightness_handler(unused_addr, *args):
+    """Set a dimmer from OSC, 0.0-1.0: /brightness LEVEL for the master
+    dimmer, or /brightness ZONE LEVEL for one of DIMMER_ZONES. Levels
+    outside 0.0-1.0 are clamped.
+    """
+    print("brightness_handler()")
+    print("args:", args)
+
+    def dimmer(level):
+        return round(min(1.0, max(0.0, float(level))) * 255)
+
+    if len(args) == 1:
+        super_strand.setBrightness(dimmer(args[0]))
+    elif len(args) == 2 and args[0] in DIMMER_ZONES:
+        super_strand.setZoneBrightness(args[0], dimmer(args[1]))
+    else:
+        print("brightness_handler: expected LEVEL or ZONE LEVEL")
+        return
+    super_strand.show()
+
+
+def stats_handler(client_address, address, *args):
+    """Reply to /stats with a JSON snapshot of the render metrics (see
+    metrics.py), sent to the asking host, on the port given as the first
+    argument, or else back to the port it was sent from.
+    """
+    reply_port = int(args[0]) if args else client_address[1]
+    client = udp_client.SimpleUDPClient(client_address[0], reply_port)
+    client.send_message("/stats", json.dumps(METRICS.snapshot()))
+
+
+def setup_buttons():
+    """Initialize physical button interrupts"""
+    GPIO.add_event_detect(TOGGLE_RED_IN, GPIO.RISING, callback=toggle_red_on, bouncetime=500)
+    GPIO.add_event_detect(BUTTON_WHITE_IN, GPIO.FALLING, callback=button_white, bouncetime=500)
+    GPIO.add_event_detect(BUTTON_AMBER_IN, GPIO.FALLING, callback=button_amber, bouncetime=500)
+    GPIO.add_event_detect(BUTTON_RED_IN, GPIO.FALLING, callback=button_red, bouncetime=500)
+
+
 # ------------------------------
 # Main code
 # ------------------------------
@@ -360,22 +453,34 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--ip", default="192.168.10.15", help="The ip to listen on")
     parser.add_argument("--port", type=int, default=8000, help="The port to listen on")
+    parser.add_argument("--stats", type=float, metavar="SECONDS",
+                        help="Collect render metrics, and print them every SECONDS")
     args = parser.parse_args()
 
-    # Initialize physical button interrupts
-    GPIO.add_event_detect(TOGGLE_RED_IN, GPIO.RISING, callback=toggle_red_on, bouncetime=500)
-    GPIO.add_event_detect(BUTTON_WHITE_IN, GPIO.FALLING, callback=button_white, bouncetime=500)
-    GPIO.add_event_detect(BUTTON_AMBER_IN, GPIO.FALLING, callback=button_amber, bouncetime=500)
-    GPIO.add_event_detect(BUTTON_RED_IN, GPIO.FALLING, callback=button_red, bouncetime=500)
+    if args.stats:
+        METRICS.enable()
+        METRICS.startLogging(args.stats)
+
+    setup_gpio()
+
+    # Intialize the SuperPixel super_strand (must be called once, before other
+    # functions, if the SuperPixel super_strand contains any NeoPixel sub-strands)
+    super_strand.begin()
+
+    setup_buttons()
 
-    # Display the default pattern once
+    # Start sending frames out, and display the default pattern once
+    render_loop.start()
     button_amber()
 
     # Set up the OSC listener
     dispatcher = dispatcher.Dispatcher()
     dispatcher.map("/erupt", erupt_handler, "Erupt")
-    # Run the server on its own thread
-    server = osc_server.ForkingOSCUDPServer((args.ip, args.port), dispatcher)
+    dispatcher.map("/brightness", brightness_handler)
+    dispatcher.map("/stats", stats_handler, needs_reply_address=True)
+    # Run the server on its own thread. Requests are handled on threads,
+    # not forked processes, so they can reach the scheduler.
+    server = osc_server.ThreadingOSCUDPServer((args.ip, args.port), dispatcher)
     server_thread = threading.Thread(target=server.serve_forever)
     server_thread.start()
     print("OSC listening on {}".format(server.server_address))
@@ -388,4 +493,5 @@ if __name__ == "__main__":
         print("\nAttempting to clean up…")
     finally:
         server.shutdown()
+        render_loop.stop()
         GPIO.cleanup()
@@ -6,7 +6,7 @@ Adafruit NeoPixel library port to control the older WS2801 pixels from
   and performs a self-test if run as main.
 
 Not 100% compatible, as it uses [r, g, b] arrays for 'color' instead of
-24-bit values.
+24-bit values (see pixelcolor.py).
 
 
 Author: Mark Boszko (boszko+paleopixel@gmail.com)
@@ -14,6 +14,10 @@ Author: Mark Boszko (boszko+paleopixel@gmail.com)
 Raspberry Pi SPI driver code for WS2801 pixels based on Adafruit_LEDpixels.py
 https://github.com/adafruit/Adafruit-Raspberry-Pi-Python-Code
 
+PaleoPixel keeps the strand's colors in its own numpy buffer, and show()
+encodes the whole frame in the strand's color order and sends it in one
+SPI transfer.
+
 Python port of NeoPixel library based on the rpi_ws281x library port,
   by Tony DiCola and Jeremy Garff
 https://github.com/jgarff/rpi_ws281x
@@ -42,6 +46,9 @@ of the license.
 
 Version History:
 
+- 3.0.0 -            - Own numpy frame buffer, sent with one SPI write per
+                       show(), replacing Adafruit_WS2801. Configurable SPI
+                       clock and color order.
 - 2.0.0 - 2018-08-22 - Updating to use Adafruit_WS2801, for Python 3, removing Numpy
 - 1.1.0 - 2016-05-08 - Updated to use numpy for the internal arrays, for
                        speed improvements
@@ -56,12 +63,25 @@ Version History:
 
 import time
 
-# Import the WS2801 module.
-import Adafruit_WS2801
-import Adafruit_GPIO.SPI as SPI
+import numpy
+
+import effects
+import hardware
+import pixelcolor
+from pixelcolor import Color
+
+# Import the SPI module (or its simulator stand-in).
+SPI = hardware.spi()
 
 # LED strip configuration:
 LED_COUNT = 50  # Number of LED pixels.
+SPI_HZ = 1000000  # SPI clock; WS2801s are rated to 25 MHz, wiring permitting
+COLOR_ORDER = 'RGB'  # Order the strand expects each pixel's bytes in
+LATCH_SECONDS = 0.0005  # Clock held low after a frame, for the WS2801s to latch it
+
+# Specify a hardware SPI connection on /dev/spidev0.0:
+SPI_PORT = 0
+SPI_DEVICE = 0
 
 
 #####
@@ -70,45 +90,60 @@ LED_COUNT = 50  # Number of LED pixels.
 #
 #####
 
-def Color(red, green, blue):
-    """Return the provided red, green, blue colors as a list.
-    Each color component should be a value 0-255 where 0 is the lowest intensity
-    and 255 is the highest intensity.
-    red, green, blue: int, 0-255
-    return: list
-    """
-    rgb = [red, green, blue]
-    return rgb
-
-
 class PaleoPixel(object):
-    def __init__(self, num):
+    def __init__(self, num, spi_hz=SPI_HZ, color_order=COLOR_ORDER):
         """Class to represent a WS2801 LED display.
 
-        num: int, number of pixels in the display strand.
+        num:         int, number of pixels in the display strand.
+        spi_hz:      int, SPI clock speed in hertz.
+        color_order: str, the order the strand takes red, green and blue in,
+                     such as 'RGB' or 'GRB'.
         """
-        # Specify a hardware SPI connection on /dev/spidev0.0:
-        SPI_PORT = 0
-        SPI_DEVICE = 0
-        self.ws2801_strand = Adafruit_WS2801.WS2801Pixels(num, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE))
+        if sorted(color_order) != ['B', 'G', 'R']:
+            raise ValueError('color_order must be an order of R, G and B: {0}'.format(color_order))
+        self._spi = SPI.SpiDev(SPI_PORT, SPI_DEVICE)
+        self._spi.set_clock_hz(spi_hz)
+        self._spi.set_mode(0)
+        self._spi.set_bit_order(SPI.MSBFIRST)
+
+        # Colors, pixel count by 3 (RGB)
+        self._pixels = pixelcolor.newFrame(num)
+        # RGB channel for each byte of a pixel on the wire
+        self._channel_order = ['RGB'.index(channel) for channel in color_order]
+        # The frame as sent: pixel count by 3, in color order, in a
+        # bytearray so it goes to SPI without another copy
+        self._wire_bytes = bytearray(num * 3)
+        self._wire_pixels = numpy.frombuffer(self._wire_bytes, dtype=numpy.uint8).reshape(num, 3)
+        # When the last frame finished going out, for the latch gap
+        self._last_write_time = None
 
     def __del__(self):
         # Clean up memory used when not needed anymore.
-        if self.ws2801_strand is not None:
-            self.ws2801_strand = None
+        if getattr(self, '_spi', None) is not None:
+            self._spi.close()
+            self._spi = None
 
     def begin(self):
-        """Initialize _led_data to zeroes, and show strand.
+        """Set all pixels to off, and show strand.
         Not necessary, since we do this in __init__, but handy.
         Mostly included for NeoPixel compatibility.
         """
-        # Clip all values to zero
-        self.ws2801_strand.clear()
-        self.ws2801_strand.show()
+        self._pixels[:] = 0
+        self.show()
 
     def show(self):
-        """Update the display with the data from the LED buffer."""
-        self.ws2801_strand.show()
+        """Update the display with the data from the LED buffer, in one SPI
+        transfer. If the last frame went out less than LATCH_SECONDS ago,
+        waits out the rest of the latch gap first, so the two frames aren't
+        clocked into each other.
+        """
+        numpy.take(self._pixels, self._channel_order, axis=1, out=self._wire_pixels)
+        if self._last_write_time is not None:
+            remaining = self._last_write_time + LATCH_SECONDS - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        self._spi.write(self._wire_bytes)
+        self._last_write_time = time.monotonic()
 
     def setPixelColor(self, n, color):
         """Set LED at position n to the provided list (in RGB order).
@@ -128,28 +163,53 @@ class PaleoPixel(object):
             # outside the strand length; throw it away
             pass
         else:
-            self.ws2801_strand.set_pixel_rgb(n, red, green, blue)
+            self._pixels[n] = (red & 0xFF, green & 0xFF, blue & 0xFF)
 
-    def getPixels(self):
-        """Return a list of tuples which allows access to the LED data
-        as [(R, G, B), ...]
+    def setPixels(self, colors):
+        """Set LEDs from an array of [R, G, B] rows, starting at pixel 0.
+        colors: numpy.array (or list), pixel count by 3 (RGB)
+        """
+        self.setRange(0, len(colors), colors)
+
+    def setRange(self, start, stop, colors):
+        """Set LEDs from start up to (not including) stop, in one slice of
+        the buffer.
+        colors: numpy.array (or list), either one [R, G, B] for the whole
+                range, or (stop - start) by 3 (RGB)
+        """
+        clipped = pixelcolor.clipRange(start, stop, colors, self.numPixels())
+        if clipped is None:
+            return  # outside the strand length; throw it away
+        start, stop, colors = clipped
+        self._pixels[start:stop] = pixelcolor.toColors(colors)
+
+    def setPixelsAt(self, indices, colors):
+        """Set the LEDs at an array of pixel positions.
+        indices: numpy.array of int pixel positions
+        colors:  numpy.array, either one [R, G, B] for every position, or
+                 len(indices) by 3 (RGB)
         """
-        pixels_rgb = []
-        for pixel_index in range(self.ws2801_strand.count()):
-            pixel_rgb = self.ws2801_strand.get_pixel_rgb(pixel_index)
-            pixels_rgb.append(pixel_rgb)
-        return pixels_rgb
+        indices, colors = pixelcolor.clipIndices(indices, colors, len(self._pixels))
+        self._pixels[indices] = pixelcolor.toColors(colors)
+
+    def fill(self, color):
+        """Set all LEDs to the provided list (in RGB order)."""
+        self.setRange(0, self.numPixels(), color)
+
+    def getPixels(self):
+        """Return the LED buffer, as a pixel count by 3 (RGB) uint8 array."""
+        return self._pixels
 
     def numPixels(self):
         """Return the number of pixels in the display."""
-        # print("numPixels: {}", self.ws2801_strand.count())
-        return self.ws2801_strand.count()
+        return len(self._pixels)
 
     def getPixelColor(self, n):
         """Get a tuple with (R, G, B) color values for the LED pixel
         at position n.
         """
-        return self.ws2801_strand.get_pixel_rgb(pixel_index)
+        red, green, blue = self._pixels[n].tolist()
+        return (red, green, blue)
 
 
 #####
@@ -160,65 +220,32 @@ class PaleoPixel(object):
 
 def colorWipe(strip, color, wait_ms=20):
     """Wipe color across display a pixel at a time."""
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, color)
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.wipe(strip, color, wait_ms)
 
 
 def theaterChase(strip, color, wait_ms=50, iterations=10):
     """Movie theater marquee style chaser animation."""
-    for j in range(iterations):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                # print("i: {}, q: {}, i+q: {}", i, q, i+q)
-                strip.setPixelColor(i + q, color)
-            strip.show()
-            time.sleep(wait_ms / 1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, Color(0, 0, 0))
+    effects.draw(strip, effects.theaterChase(strip.numPixels(), color, iterations), wait_ms)
 
 
 def wheel(pos):
     """Generate rainbow colors across 0-255 positions."""
-    if pos < 85:
-        return Color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Color(0, pos * 3, 255 - pos * 3)
+    return Color(*effects.wheel(pos).tolist())
 
 
 def rainbow(strip, wait_ms=20, iterations=1):
     """Draw rainbow that fades across all pixels at once."""
-    for j in range(256 * iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((i + j) % 255))
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.draw(strip, effects.rainbow(strip.numPixels(), iterations), wait_ms)
 
 
 def rainbowCycle(strip, wait_ms=20, iterations=2):
     """Draw rainbow that uniformly distributes itself across all pixels."""
-    for j in range(256 * iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel(((i * 256 // strip.numPixels()) + j) % 255))
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.draw(strip, effects.rainbowCycle(strip.numPixels(), iterations), wait_ms)
 
 
 def theaterChaseRainbow(strip, wait_ms=50):
     """Rainbow movie theater marquee style chaser animation."""
-    for j in range(256):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, wheel((i + j) % 255))
-            strip.show()
-            time.sleep(wait_ms / 1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, Color(0, 0, 0))
+    effects.draw(strip, effects.theaterChaseRainbow(strip.numPixels()), wait_ms)
 
 
 #####
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+The one color representation for the tiki nook pixels.
+
+A color is a uint8 numpy array of [R, G, B], and a frame (or any other pixel
+buffer) is a uint8 numpy array of [R, G, B] rows, one row per pixel: 3 bytes
+a pixel. Strands only convert to their own wire formats when they're sent
+out, and do it on whole arrays with pack() and unpack().
+
+Color() hands back a shared, read-only array for each color instead of
+allocating a new one on every call, so it is safe to use in hot loops, and
+the named colors below are those same arrays. Copy one to change it.
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import numpy
+
+# Colors (and frames) are this type
+COLOR_DTYPE = numpy.uint8
+
+# Most colors Color() keeps to hand out again
+COLOR_CACHE_SIZE = 4096
+
+# Colors handed out by Color(), by (red, green, blue)
+_color_cache = {}
+
+# Bit shifts of each channel, for each packed 24-bit channel order
+PACK_SHIFTS = {
+    'RGB': (16, 8, 0),
+    'RBG': (16, 0, 8),
+    'GRB': (8, 16, 0),
+    'GBR': (0, 16, 8),
+    'BRG': (8, 0, 16),
+    'BGR': (0, 8, 16),
+}
+
+
+def Color(red, green, blue):
+    """Return the provided red, green, blue colors as a uint8 numpy array.
+    Each color component should be a value 0-255 where 0 is the lowest intensity
+    and 255 is the highest intensity.
+    The array is shared by every caller asking for the same color, so it is
+    read-only.
+    red, green, blue: int, 0-255
+    return: numpy.array
+    """
+    key = (int(red) & 0xFF, int(green) & 0xFF, int(blue) & 0xFF)
+    color = _color_cache.get(key)
+    if color is None:
+        color = numpy.array(key, dtype=COLOR_DTYPE)
+        color.flags.writeable = False
+        if len(_color_cache) < COLOR_CACHE_SIZE:
+            color = _color_cache.setdefault(key, color)
+    return color
+
+
+BLACK = Color(0, 0, 0)
+WHITE = Color(255, 255, 255)
+RED = Color(255, 0, 0)
+GREEN = Color(0, 255, 0)
+BLUE = Color(0, 0, 255)
+
+
+def newFrame(num_pixels, color=None):
+    """Return a frame for num_pixels, filled with color (black if None).
+    return: numpy.array, num_pixels by 3 (RGB), uint8
+    """
+    frame = numpy.zeros((num_pixels, 3), dtype=COLOR_DTYPE)
+    if color is not None:
+        frame[:] = color
+    return frame
+
+
+def clipRange(start, stop, colors, num_pixels):
+    """Return (start, stop, colors) for a write to pixels start up to (not
+    including) stop, trimmed to a buffer of num_pixels, or None if none of
+    it lands in the buffer.
+    colors: one [R, G, B] for the whole range, or (stop - start) [R, G, B] rows
+    """
+    colors = numpy.asarray(colors)
+    first, stop = max(start, 0), min(stop, num_pixels)
+    if stop <= first:
+        return None
+    if colors.ndim > 1:
+        colors = colors[first - start:stop - start]
+    return first, stop, colors
+
+
+def clipIndices(indices, colors, num_pixels):
+    """Return (indices, colors) for a write to pixels at an array of
+    positions, without the positions outside a buffer of num_pixels.
+    colors: one [R, G, B] for every position, or len(indices) [R, G, B] rows
+    """
+    indices = numpy.asarray(indices, dtype=numpy.intp)
+    colors = numpy.asarray(colors)
+    in_bounds = (indices >= 0) & (indices < num_pixels)
+    if not in_bounds.all():
+        # out of bounds; throw those away
+        indices = indices[in_bounds]
+        if colors.ndim > 1:
+            colors = colors[in_bounds]
+    return indices, colors
+
+
+def toColors(colors):
+    """Return one color, or an array of colors, as uint8 [R, G, B] rows,
+    without copying if it already is one.
+    colors: [R, G, B], or any number of them, as lists or arrays of ints
+    """
+    colors = numpy.asarray(colors)
+    if colors.dtype == COLOR_DTYPE:
+        return colors
+    return (colors.astype(numpy.int64) & 0xFF).astype(COLOR_DTYPE)
+
+
+def pack(colors, order='RGB'):
+    """Return colors packed into 24-bit ints, as a uint32 array (or one
+    uint32, for one color), with channels in the given wire order.
+    colors: [R, G, B] rows
+    order:  str, such as 'RGB', or 'GRB' for NeoPixels
+    """
+    rgb = toColors(colors).astype(numpy.uint32)
+    red_shift, green_shift, blue_shift = PACK_SHIFTS[order]
+    return (rgb[..., 0] << red_shift) | (rgb[..., 1] << green_shift) | (rgb[..., 2] << blue_shift)
+
+
+def unpack(packed, order='RGB'):
+    """Return 24-bit ints (in the given wire order) unpacked into uint8
+    [R, G, B] rows. The reverse of pack().
+    """
+    packed = numpy.asarray(packed, dtype=numpy.uint32)
+    colors = numpy.empty(packed.shape + (3,), dtype=COLOR_DTYPE)
+    for channel, shift in enumerate(PACK_SHIFTS[order]):
+        colors[..., channel] = (packed >> shift) & 0xFF
+    return colors
+
+
+def outputTable(gamma=1.0, brightness=255):
+    """Return a lookup table of output levels, as a 256 by 256 uint8 array
+    indexed by [dimmer, value]: value 0-255, dimmed by dimmer 0-255 and by
+    brightness 0-255, then gamma corrected. Dimming comes before the gamma
+    curve, so halving a dimmer looks half as bright.
+    gamma: float, 1.0 for none; around 2.2 for most LEDs
+    brightness is clamped to 0-255.
+    """
+    brightness = min(255, max(0, brightness))
+    levels = numpy.arange(256, dtype=numpy.float64) / 255.0
+    dimmed = numpy.outer(levels * (brightness / 255.0), levels)
+    return numpy.rint(255.0 * dimmed ** gamma).astype(COLOR_DTYPE)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Render loop for a SuperPixel strand: one thread, which owns sending frames
+out to the pixels, at a fixed frame rate.
+
+Everything else (effects, GPIO callbacks, the OSC server) only writes into
+the SuperPixel's LED buffer, which acts as the one shared framebuffer. Their
+calls to show() become requests, which the render thread picks up on its
+next tick, so only one thread ever drives the hardware, and frame timing
+doesn't depend on whichever thread happens to be drawing. Each tick latches
+the SuperPixel's back buffer and returns while the frame is on the wire, so
+the next frame's effects run at the same time.
+
+Effects can also be registered as producers, which the render thread calls
+once per frame:
+    - a function, called as producer(frame_time), where frame_time is the
+      float seconds since the loop started. It can draw into the strand
+      itself and return None, or return a whole frame as a pixel count by 3
+      (RGB) array.
+    - an iterator (such as a generator) of whole frames, or Nones. It is
+      removed when it runs out.
+
+Usage:
+    render_loop = RenderLoop(super_strand, fps=30)
+    render_loop.start()
+    ...
+    render_loop.stop()
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import threading
+import time
+import traceback
+
+from metrics import METRICS
+
+# Frames per second sent out to the pixels
+RENDER_FPS = 30
+
+
+class RenderLoop(object):
+    def __init__(self, strand, fps=RENDER_FPS):
+        """Class to send a SuperPixel strand's frames out from one thread.
+
+        strand - The SuperPixel that holds the framebuffer
+        fps    - float, target frames per second
+        """
+        self._strand = strand
+        self._fps = fps
+        self._frame_delay = 1.0 / fps
+        self._producers = []
+        self._producers_lock = threading.Lock()
+        self._show_requested = False
+        self._force_requested = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Frame statistics
+        self.frame_count = 0
+        self.late_frames = 0
+
+    def start(self):
+        """Attach to the strand, and start the render thread."""
+        if self._thread is not None:
+            return  # already running
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='RenderLoop')
+        self._thread.daemon = True
+        self._strand.attachRenderLoop(self)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the render thread, and hand show() back to the strand."""
+        if self._thread is None:
+            return  # not running
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._strand.attachRenderLoop(None)
+        # Send out anything drawn since the last tick, and wait for it
+        self._strand.show()
+
+    def isRenderThread(self):
+        """Return True if called from the render thread."""
+        return threading.current_thread() is self._thread
+
+    def requestShow(self, force=False):
+        """Ask for the strand to be shown on the next tick."""
+        if force:
+            self._force_requested = True
+        self._show_requested = True
+
+    def addProducer(self, producer):
+        """Add an effect to be run once per frame by the render thread.
+        producer: function of frame_time, or an iterator of frames
+        """
+        with self._producers_lock:
+            self._producers.append(producer)
+
+    def removeProducer(self, producer):
+        """Stop running an effect. Does nothing if it isn't running."""
+        with self._producers_lock:
+            if producer in self._producers:
+                self._producers.remove(producer)
+
+    def fps(self):
+        """Return the target frames per second"""
+        return self._fps
+
+    def _runProducers(self, frame_time):
+        """Run every producer once. Return True if any of them drew."""
+        with self._producers_lock:
+            producers = list(self._producers)
+        drew = False
+        for producer in producers:
+            if callable(producer):
+                frame = producer(frame_time)
+            else:
+                frame = next(producer, StopIteration)
+                if frame is StopIteration:
+                    self.removeProducer(producer)
+                    continue
+            if frame is not None:
+                self._strand.setPixels(frame)
+            drew = True
+        return drew
+
+    def _run(self):
+        """The render thread: run the producers and send the frame out once
+        per tick. Each tick has a deadline on a fixed clock; if we fall more
+        than a frame behind, the missed frames are counted as late and the
+        clock skips ahead, rather than trying to catch up.
+        """
+        start_time = time.monotonic()
+        deadline = start_time
+        last_frame_time = None
+        while not self._stop_event.is_set():
+            timing = METRICS.enabled
+            if timing:
+                effect_start = time.perf_counter()
+                if last_frame_time is not None:
+                    METRICS.record('frame', effect_start - last_frame_time)
+                last_frame_time = effect_start
+            try:
+                drew = self._runProducers(deadline - start_time)
+                if timing:
+                    METRICS.record('effect', time.perf_counter() - effect_start)
+                    METRICS.count('frames')
+                if drew or self._show_requested:
+                    self._show_requested = False
+                    force = self._force_requested
+                    self._force_requested = False
+                    # Returns once the frame is latched, so the next one is
+                    # drawn while this one is on the wire
+                    self._strand.show(force=force, block=False)
+            except Exception:
+                # Don't let one bad frame take down the render thread
+                traceback.print_exc()
+            self.frame_count = self.frame_count + 1
+
+            deadline = deadline + self._frame_delay
+            now = time.monotonic()
+            if now > deadline:
+                # Late: count the ticks we missed, and skip the clock past them
+                missed = int((now - deadline) / self._frame_delay) + 1
+                self.late_frames = self.late_frames + missed
+                if METRICS.enabled:
+                    METRICS.count('frames.late', missed)
+                deadline = deadline + missed * self._frame_delay
+            self._stop_event.wait(max(0.0, deadline - time.monotonic()))
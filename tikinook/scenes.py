@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Scene presets: named, static looks for the whole strand, such as the nook's
+amber idle scene.
+
+A Scene is a list of steps, each painting one color onto part of the
+strand: a whole PixelGrid, one of its rows or cells, a SuperPixel dimmer
+zone, or a list of pixels. Steps apply in order, over black (or over a
+base scene's steps), so later steps win where they overlap.
+
+The first time a scene is used on a strand, its steps are compiled into
+one full-strand frame, and the frame is kept until the layout changes (a
+different strand, or a zone added again). Recalling a scene is then one
+bulk setPixels(), and crossfading to it is the SuperPixel fade engine
+aimed at that frame, with no per-pixel Python either way.
+
+Usage:
+    AMBER = Scene('amber')
+    AMBER.setRow(rattan_grid, 0, Color(250, 127, 0))
+    AMBER.setAll(shelf_front_grid, Color(50, 20, 10))
+    WHITE = Scene('white', base=AMBER)
+    WHITE.setRow(shelf_back_grid, 2, Color(255, 160, 64))
+
+    AMBER.recall(super_strand)
+    scheduler.run(WHITE.fadeSteps(super_strand, seconds=0.5))
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import numpy
+
+import pixelcolor
+
+
+class Scene(object):
+    def __init__(self, name, base=None):
+        """Class to hold a named scene preset.
+
+        name - str, the scene's name
+        base - Scene whose steps this one starts from, if any. Steps added to
+               the base later are not picked up.
+
+        Internal representation:
+            _steps    - (kind, target, color) for each step, in order:
+                        ('pixels', pixel positions, color), or ('zone', zone
+                        name, color)
+            _compiled - (strand, zone index arrays, frame) from the last
+                        compile, or None
+        """
+        self.name = name
+        self._steps = list(base._steps) if base is not None else []
+        self._compiled = None
+
+    def _addStep(self, kind, target, color):
+        self._steps.append((kind, target, pixelcolor.toColors(color).copy()))
+        self._compiled = None
+        return self
+
+    #####
+    #
+    # Steps
+    #
+    # Each returns the scene, so steps can be chained.
+    #
+    #####
+
+    def setAll(self, grid, color):
+        """Paint every pixel of a PixelGrid the provided color as [R, G, B]."""
+        return self._addStep('pixels', grid.pixelIndices(), color)
+
+    def setRow(self, grid, row, color):
+        """Paint one row of a PixelGrid the provided color as [R, G, B]."""
+        return self._addStep('pixels', grid.indexMap()[row][grid.mask()[row]], color)
+
+    def setPixel(self, grid, x, y, color):
+        """Paint the PixelGrid cell at x, y the provided color as [R, G, B].
+        Raises ValueError if the cell isn't a pixel of the grid.
+        """
+        if x < 0 or y < 0 or y >= grid.numRows() or x >= grid.rowLength(y):
+            raise ValueError('No pixel at {0}, {1} in the grid'.format(x, y))
+        return self._addStep('pixels', grid.indexMap()[y:y + 1, x], color)
+
+    def setPixels(self, indices, color):
+        """Paint strand pixels at an array of positions the provided color as
+        [R, G, B].
+        """
+        return self._addStep('pixels', numpy.asarray(indices, dtype=numpy.intp), color)
+
+    def setZone(self, zone, color):
+        """Paint a SuperPixel dimmer zone (see SuperPixel.addZone) the
+        provided color as [R, G, B]. The zone is looked up when the scene
+        is compiled.
+        """
+        return self._addStep('zone', zone, color)
+
+    #####
+    #
+    # Using the scene
+    #
+    #####
+
+    def _zoneArrays(self, strand):
+        """Return the strand's index array for each zone step, in order."""
+        return [strand.zonePixels(target) for kind, target, color in self._steps if kind == 'zone']
+
+    def frame(self, strand):
+        """Return the scene as a frame for the strand: a read-only pixel count
+        by 3 (RGB) uint8 array, compiled the first time, and then cached
+        until the layout changes.
+        """
+        zone_arrays = self._zoneArrays(strand)
+        compiled = self._compiled
+        if (compiled is not None and compiled[0] is strand and len(compiled[2]) == strand.numPixels()
+                and len(compiled[1]) == len(zone_arrays)
+                and all(cached is current for cached, current in zip(compiled[1], zone_arrays))):
+            return compiled[2]
+
+        frame = pixelcolor.newFrame(strand.numPixels())
+        zones = iter(zone_arrays)
+        for kind, target, color in self._steps:
+            indices = next(zones) if kind == 'zone' else target
+            indices = indices[(indices >= 0) & (indices < len(frame))]
+            frame[indices] = color
+        frame.flags.writeable = False
+        self._compiled = (strand, zone_arrays, frame)
+        return frame
+
+    def recall(self, strand):
+        """Draw the scene onto the strand, in one write."""
+        strand.setPixels(self.frame(strand))
+
+    def fadeSteps(self, strand, seconds, easing='linear'):
+        """Generator which crossfades the strand (a SuperPixel) from what it
+        shows now to the scene, through SuperPixel.fadeSteps, then draws the
+        scene exactly.
+        """
+        frame = self.frame(strand)
+        yield from strand.fadeSteps(frame, seconds, easing)
+        strand.setPixels(frame)
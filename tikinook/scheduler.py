@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Effect scheduler: runs light shows as cancellable, time-sliced tasks on the
+render thread, instead of blocking whichever thread started them.
+
+An effect is a generator. Each time it is stepped, it draws whatever it
+likes into the strand (or its grids), then yields how long to wait before
+its next step:
+    - None, to be stepped again on the next frame
+    - a float number of seconds
+So a blocking show like:
+    shelf_grid.setAllColorRGB(255, 0, 0)
+    time.sleep(10)
+becomes:
+    shelf_grid.setAllColorRGB(255, 0, 0)
+    yield 10
+
+Only one effect runs at a time. Starting a new effect with the same or a
+higher priority preempts the running one at the next frame: the old
+generator is closed (so any try/finally cleanup in it runs, such as turning
+the smoke machine off) before the new one takes its first step. Starting an
+effect with a lower priority than the running one does nothing.
+
+The scheduler is itself a RenderLoop producer, and only ever steps effects
+on the render thread, so effects never race each other for the pixels.
+
+Usage:
+    scheduler = EffectScheduler(render_loop)
+    scheduler.run(volcano_show(), priority=PRIORITY_BUTTON)
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import threading
+import traceback
+
+# Effect priorities
+PRIORITY_IDLE = 0  # Background effects; anything else preempts them
+PRIORITY_BUTTON = 10  # Effects started by a button press, or OSC
+
+
+class _Task(object):
+    def __init__(self, effect, priority, name):
+        """One scheduled effect, and when it next wants to be stepped."""
+        self.effect = effect
+        self.priority = priority
+        self.name = name
+        self.wake_time = None  # frame_time of the next step; None is now
+
+
+class EffectScheduler(object):
+    def __init__(self, render_loop=None):
+        """Class to run one effect at a time, stepped once per frame.
+
+        render_loop - RenderLoop to step effects from. If None, call the
+                      scheduler as scheduler(frame_time) once per frame.
+        """
+        self._lock = threading.Lock()
+        self._task = None  # running task, only touched on the render thread
+        self._pending = None  # task waiting to preempt it at the next frame
+        self._cancel_requested = False
+        if render_loop is not None:
+            render_loop.addProducer(self)
+
+    def run(self, effect, priority=PRIORITY_BUTTON, name=None):
+        """Start an effect at the next frame, preempting the running effect
+        if this one's priority is the same or higher.
+        effect: generator, as described above
+        Return True if the effect will run, or False if it was refused.
+        """
+        task = _Task(effect, priority, name or getattr(effect, '__name__', 'effect'))
+        with self._lock:
+            current = self._pending or self._task
+            if current is not None and priority < current.priority:
+                effect.close()
+                return False
+            if self._pending is not None:
+                self._pending.effect.close()  # never got to start
+            self._pending = task
+        return True
+
+    def cancel(self):
+        """Stop the running effect at the next frame."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.effect.close()
+                self._pending = None
+            self._cancel_requested = True
+
+    def running(self):
+        """Return the name of the running (or about to run) effect, or None."""
+        with self._lock:
+            current = self._pending or self._task
+        return None if current is None else current.name
+
+    def __call__(self, frame_time):
+        """Step the running effect, if it's due. Called once per frame."""
+        with self._lock:
+            pending = self._pending
+            self._pending = None
+            cancel = self._cancel_requested
+            self._cancel_requested = False
+            previous = self._task
+            if pending is not None or cancel:
+                self._task = pending
+            task = self._task
+        if previous is not None and previous is not task:
+            previous.effect.close()
+
+        if task is None:
+            return None
+        if task.wake_time is not None and frame_time < task.wake_time:
+            return None
+
+        try:
+            wait = next(task.effect)
+        except StopIteration:
+            wait = None
+            self._finish(task)
+        except Exception:
+            # Don't let one broken effect take down the render thread
+            traceback.print_exc()
+            wait = None
+            self._finish(task)
+        task.wake_time = None if wait is None else frame_time + wait
+        return None
+
+    def _finish(self, task):
+        """Forget a task that has ended on its own."""
+        with self._lock:
+            if self._task is task:
+                self._task = None
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+In-memory stand-ins for the Raspberry Pi hardware libraries, so the tiki
+nook code can run on an ordinary computer at full speed. Select them with
+TIKINOOK_BACKEND=simulator; see hardware.py.
+
+Stands in for:
+    _rpi_ws281x      - the ws2811_* functions neopixel.py uses, driving
+                       SimulatedChannel LED arrays
+    Adafruit_GPIO.SPI - SpiDev, which keeps the bytes written to it
+    RPi.GPIO         - GPIO, a SimulatedGPIO with scriptable inputs
+
+Nothing here touches a device, and by default nothing sleeps, so the
+numbers you get from profiling are the Python-side cost alone. Instead, the
+pixel backends keep a model of how long each frame would spend on the wire:
+    ws281x - 24 bits per pixel at the controller's frequency (1.25 us a
+             bit at 800 kHz), plus the reset/latch gap. Both PWM channels
+             are sent at once, so a render takes as long as the longest.
+    SPI    - 8 bits per byte at the SPI clock, plus the WS2801 latch gap.
+wire_report() runs frames through a strand and sets the theoretical
+maximum fps for the wire against the measured Python-side cost, and
+running this file prints that report for a pixel layout. Set
+TIKINOOK_SIM_REALTIME=1 to make the backends actually sleep for their
+wire time, as the real hardware would block.
+
+Scripting inputs:
+    GPIO.press(BUTTON_RED_IN)             # pull-up button: falling, rising
+    GPIO.set_input(TOGGLE_RED_IN, True)   # toggle on: rising edge
+    GPIO.run_script([(0.5, TOGGLE_RED_IN, True),
+                     (1.0, BUTTON_RED_IN, False)])  # (seconds, pin, level)
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import argparse
+import os
+import threading
+import time
+import weakref
+
+import numpy
+
+# Sleep for the modelled wire time of every frame, like the hardware?
+SIMULATE_WIRE_TIME = os.environ.get('TIKINOOK_SIM_REALTIME', '') not in ('', '0')
+
+# Timing model
+WS281X_BITS_PER_PIXEL = 24
+WS281X_RESET_SECONDS = 0.000280  # low time to latch, for current WS2812Bs
+WS2801_LATCH_SECONDS = 0.000500  # clock low time to latch
+
+# Every simulated pixel device, for wire_report()
+_devices = weakref.WeakSet()
+
+
+#####
+#
+# Timing model
+#
+#####
+
+def ws281x_wire_time(count, freq_hz=800000):
+    """Return seconds to send count pixels down a ws281x line, and latch."""
+    if count <= 0:
+        return 0.0
+    return count * WS281X_BITS_PER_PIXEL / float(freq_hz) + WS281X_RESET_SECONDS
+
+
+def spi_wire_time(byte_count, clock_hz):
+    """Return seconds to clock byte_count bytes out over SPI to a WS2801
+    strand, and latch.
+    """
+    if byte_count <= 0:
+        return 0.0
+    return byte_count * 8 / float(clock_hz) + WS2801_LATCH_SECONDS
+
+
+def _spend_wire_time(device, seconds):
+    """Add a frame's wire time to a device, and sleep it if asked to."""
+    device.last_wire_time = seconds
+    device.wire_seconds = device.wire_seconds + seconds
+    if SIMULATE_WIRE_TIME and seconds > 0:
+        time.sleep(seconds)
+
+
+#####
+#
+# ws281x - stand-in for the _rpi_ws281x SWIG module
+#
+#####
+
+class SimulatedChannel(object):
+    def __init__(self):
+        """One PWM channel of a ws2811_t: its settings and LED array."""
+        self.count = 0
+        self.gpionum = 0
+        self.invert = 0
+        self.brightness = 0
+        self.leds = numpy.zeros(0, dtype=numpy.uint32)
+        self.render_count = 0
+
+
+class SimulatedWs2811(object):
+    def __init__(self):
+        """Stand-in for a ws2811_t controller struct, with two channels."""
+        self.freq = 0
+        self.dmanum = 0
+        self.channels = [SimulatedChannel(), SimulatedChannel()]
+        self.initialized = False
+        self.render_count = 0
+        self.last_wire_time = 0.0
+        self.wire_seconds = 0.0
+        _devices.add(self)
+
+    def wire_time(self):
+        """Return seconds one render spends on the wire. Both channels are
+        sent at the same time, so it's the longer of the two.
+        """
+        return max(ws281x_wire_time(channel.count, self.freq) for channel in self.channels)
+
+    def describe(self):
+        counts = '+'.join(str(channel.count) for channel in self.channels if channel.count > 0)
+        return 'ws281x {0} px @ {1} Hz'.format(counts, self.freq)
+
+
+def new_ws2811_t():
+    return SimulatedWs2811()
+
+
+def delete_ws2811_t(leds):
+    pass
+
+
+def ws2811_channel_get(leds, channum):
+    return leds.channels[channum]
+
+
+def ws2811_channel_t_count_set(channel, count):
+    channel.count = count
+    channel.leds = numpy.zeros(count, dtype=numpy.uint32)
+
+
+def ws2811_channel_t_count_get(channel):
+    return channel.count
+
+
+def ws2811_channel_t_gpionum_set(channel, gpionum):
+    channel.gpionum = gpionum
+
+
+def ws2811_channel_t_invert_set(channel, invert):
+    channel.invert = invert
+
+
+def ws2811_channel_t_brightness_set(channel, brightness):
+    channel.brightness = brightness
+
+
+def ws2811_t_freq_set(leds, freq):
+    leds.freq = freq
+
+
+def ws2811_t_dmanum_set(leds, dmanum):
+    leds.dmanum = dmanum
+
+
+def ws2811_channel_t_leds_get(channel):
+    # The real one returns a SWIG pointer, whose int() is the address of the
+    # channel's uint32 LED array (NULL until ws2811_init)
+    return channel.leds.ctypes.data
+
+
+def ws2811_led_get(channel, n):
+    return int(channel.leds[n])
+
+
+def ws2811_led_set(channel, n, color):
+    channel.leds[n] = color
+    return 0
+
+
+def ws2811_init(leds):
+    leds.initialized = True
+    return 0
+
+
+def ws2811_render(leds):
+    if not leds.initialized:
+        return -1  # as the real library would fail
+    leds.render_count = leds.render_count + 1
+    for channel in leds.channels:
+        if channel.count > 0:
+            channel.render_count = channel.render_count + 1
+    _spend_wire_time(leds, leds.wire_time())
+    return 0
+
+
+def ws2811_fini(leds):
+    leds.initialized = False
+
+
+#####
+#
+# SPI - stand-in for Adafruit_GPIO.SPI
+#
+#####
+
+MSBFIRST = 0
+LSBFIRST = 1
+
+
+class SpiDev(object):
+    def __init__(self, port, device, max_speed_hz=500000):
+        """Stand-in for an SPI device, which keeps what's written to it."""
+        self.port = port
+        self.device = device
+        self.clock_hz = max_speed_hz
+        self.mode = 0
+        self.bit_order = MSBFIRST
+        self.write_count = 0
+        self.last_write = b''
+        self.last_wire_time = 0.0
+        self.wire_seconds = 0.0
+        _devices.add(self)
+
+    def describe(self):
+        return 'SPI {0}.{1} @ {2} Hz'.format(self.port, self.device, self.clock_hz)
+
+    def set_clock_hz(self, hz):
+        self.clock_hz = hz
+
+    def set_mode(self, mode):
+        self.mode = mode
+
+    def set_bit_order(self, order):
+        self.bit_order = order
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        self.last_write = bytes(bytearray(data))
+        self.write_count = self.write_count + 1
+        _spend_wire_time(self, spi_wire_time(len(self.last_write), self.clock_hz))
+
+
+#####
+#
+# GPIO - stand-in for RPi.GPIO, with scriptable inputs
+#
+#####
+
+class SimulatedGPIO(object):
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        """Stand-in for the RPi.GPIO module. Output levels are kept in
+        outputs, and inputs are driven by set_input(), press() or
+        run_script(), which call any edge callbacks right away, on the
+        calling thread.
+        """
+        self._lock = threading.RLock()
+        self.mode = None
+        self.levels = {}
+        self.outputs = {}
+        self._callbacks = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        with self._lock:
+            if direction == self.OUT:
+                self.outputs[pin] = self.LOW if initial is None else initial
+            else:
+                # Inputs rest at whatever their pull resistor sets
+                self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, level):
+        self.outputs[pin] = self.HIGH if level else self.LOW
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self._lock:
+            self._callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        with self._lock:
+            self._callbacks.pop(pin, None)
+
+    def cleanup(self):
+        with self._lock:
+            self._callbacks.clear()
+            self.outputs.clear()
+
+    # Scripting
+
+    def set_input(self, pin, level):
+        """Drive an input pin to level, calling its callback if that makes
+        the edge it's waiting for.
+        """
+        level = self.HIGH if level else self.LOW
+        with self._lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+            edge, callback = self._callbacks.get(pin, (None, None))
+        if callback is None or level == previous:
+            return
+        if (edge == self.BOTH or (edge == self.RISING and level == self.HIGH)
+                or (edge == self.FALLING and level == self.LOW)):
+            callback(pin)
+
+    def press(self, pin):
+        """Press and release a pull-up button: falling, then rising edge."""
+        self.set_input(pin, self.LOW)
+        self.set_input(pin, self.HIGH)
+
+    def run_script(self, events, wait=True):
+        """Play back a list of (seconds, pin, level) input events, where
+        seconds is measured from the start of the script. With wait=False,
+        the script runs on its own thread, which is returned.
+        """
+        def play():
+            start_time = time.monotonic()
+            for seconds, pin, level in sorted(events, key=lambda event: event[0]):
+                remaining = start_time + seconds - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.set_input(pin, level)
+
+        if wait:
+            play()
+            return None
+        script_thread = threading.Thread(target=play, name='GPIOScript')
+        script_thread.daemon = True
+        script_thread.start()
+        return script_thread
+
+
+GPIO = SimulatedGPIO()
+
+
+#####
+#
+# Wire report
+#
+#####
+
+def wire_report(strand, frames=100):
+    """Push frames of random colors through a strand (such as a SuperPixel
+    built on simulated sub-strands), showing each one, and return a dict
+    comparing the measured Python-side cost of a frame to the modelled time
+    it spends on the wire:
+        python_ms       - measured time to set and show a frame, less any
+                          simulated wire time slept
+        wire_ms         - modelled wire time per frame, over all devices;
+                          the slowest device's, if the strand shows its
+                          sub-strands concurrently (see SuperPixel), or
+                          else their total, shown one after another
+        devices         - wire_ms for each simulated device used
+        wire_max_fps    - fastest frame rate the wire allows
+        python_max_fps  - fastest frame rate the Python side allows
+        achievable_fps  - both together
+        bound           - 'wire' or 'cpu', whichever costs more
+    """
+    pixel_count = strand.numPixels()
+    random_state = numpy.random.RandomState(0)
+    colors = random_state.randint(0, 256, size=(frames, pixel_count, 3))
+
+    devices = list(_devices)
+    wire_before = [device.wire_seconds for device in devices]
+    start_time = time.perf_counter()
+    for frame in colors:
+        strand.setPixels(frame)
+        strand.show()
+    elapsed = time.perf_counter() - start_time
+
+    device_reports = []
+    device_wire_seconds = [0.0]
+    for device, before in zip(devices, wire_before):
+        device_seconds = (device.wire_seconds - before) / frames
+        if device_seconds > 0:
+            device_reports.append({'device': device.describe(), 'wire_ms': device_seconds * 1000.0})
+            device_wire_seconds.append(device_seconds)
+    if getattr(strand, 'concurrentOutput', lambda: False)():
+        wire_seconds = max(device_wire_seconds)
+    else:
+        wire_seconds = sum(device_wire_seconds)
+
+    python_seconds = elapsed / frames
+    if SIMULATE_WIRE_TIME:
+        python_seconds = max(0.0, python_seconds - wire_seconds)
+
+    def max_fps(seconds):
+        return 1.0 / seconds if seconds > 0 else float('inf')
+
+    return {
+        'pixels': pixel_count,
+        'frames': frames,
+        'python_ms': python_seconds * 1000.0,
+        'wire_ms': wire_seconds * 1000.0,
+        'devices': device_reports,
+        'wire_max_fps': max_fps(wire_seconds),
+        'python_max_fps': max_fps(python_seconds),
+        'achievable_fps': max_fps(python_seconds + wire_seconds),
+        'bound': 'wire' if wire_seconds > python_seconds else 'cpu',
+    }
+
+
+def print_wire_report(report):
+    """Print a wire_report() as a table."""
+    print('{0} pixels, {1} frames'.format(report['pixels'], report['frames']))
+    for device in report['devices']:
+        print('  {0:<36} wire {1:8.3f} ms'.format(device['device'], device['wire_ms']))
+    print('  {0:<36} wire {1:8.3f} ms  max {2:7.1f} fps'.format('all devices', report['wire_ms'],
+                                                                report['wire_max_fps']))
+    print('  {0:<36}      {1:8.3f} ms  max {2:7.1f} fps'.format('python', report['python_ms'],
+                                                                report['python_max_fps']))
+    print('  achievable {0:.1f} fps, {1}-bound'.format(report['achievable_fps'], report['bound']))
+
+
+# Main program logic follows:
+if __name__ == '__main__':
+    import hardware
+    hardware.use_backend(hardware.SIMULATOR)
+    import neopixel
+    import paleopixel
+    import superpixel
+    # The backends registered their devices with the imported module, not
+    # with this __main__ copy of it
+    import simulator
+
+    parser = argparse.ArgumentParser(description='Report wire time against Python cost for a pixel layout')
+    parser.add_argument('--neopixels', type=int, default=superpixel.NEOPIXEL_COUNT, help='NeoPixel count')
+    parser.add_argument('--split', type=int, default=0,
+                        help='NeoPixels to move to the second PWM channel, rendered with the first')
+    parser.add_argument('--paleopixels', type=int, default=superpixel.PALEOPIXEL_COUNT, help='PaleoPixel count')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to measure')
+    args = parser.parse_args()
+
+    strands = []
+    if args.neopixels > 0:
+        neopixel_strand = neopixel.Adafruit_NeoPixel(args.neopixels - args.split, superpixel.NEOPIXEL_PIN)
+        strands.append(neopixel_strand)
+        if args.split > 0:
+            strands.append(neopixel_strand.addChannel(args.split, superpixel.NEOPIXEL_SPLIT_PIN))
+    if args.paleopixels > 0:
+        strands.append(paleopixel.PaleoPixel(args.paleopixels))
+    super_strand = superpixel.SuperPixel(*strands)
+    super_strand.begin()
+    simulator.print_wire_report(simulator.wire_report(super_strand, args.frames))
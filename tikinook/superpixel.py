@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import hashlib
+import json
+import os
+import queue
+import threading
 import time
 
 import cv2
 import numpy
 import subprocess
 
+import effects
 import neopixel
 import paleopixel
+import pixelcolor
+from metrics import METRICS
+from pixelcolor import Color
 
 # SuperPixel
 # Author:  Mark Boszko
@@ -21,6 +30,7 @@ import paleopixel
 # My LED strip configurations (for test):
 NEOPIXEL_COUNT = 271  # Number of NeoPixels in the strand
 NEOPIXEL_PIN = 18  # GPIO pin connected to the pixels (must support PWM!)
+NEOPIXEL_SPLIT_PIN = 13  # GPIO pin for a second NeoPixel channel (PWM1)
 PALEOPIXEL_COUNT = 50  # Number of PaleoPixels in the strand
 
 # My grid configuration (for test):
@@ -36,52 +46,278 @@ TIKI_NOOK_GRID = [(311, 10), (310, -10), (291, 10), (290, -10), (271, 10),
 # Fade frames per second
 FADE_FPS = 30
 
+# Frame rate for PixelPlayer clips that don't report their own
+PLAYER_DEFAULT_FPS = 30
+
+# Where PixelPlayer keeps compiled clips between runs
+PLAYER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tikinook')
+
+# Frames PixelPlayer decodes ahead of the playhead when streaming
+PLAYER_STREAM_FRAMES = 30
+
 
 #####
 #
-# SuperPixel - superset pixel strand class
+# Fade easing curves
 #
 #####
 
-# FIXME: We need to make sure that we use the RGB color functions for all pixel
-# settings, because NeoPixels and PaleoPixels now use different internal
-# color representations.
-# PaleoPixel color = [R, G, B] numpy.array
-# NeoPixel color = 24-bit color int
-
-def Color(red, green, blue):
-    """Return the provided red, green, blue colors as a numpy array.
-    Each color component should be a value 0-255 where 0 is the lowest intensity
-    and 255 is the highest intensity.
-    red, green, blue: int, 0-255
-    return: numpy.array
+# Each curve maps linear fade progress, 0.0-1.0, to eased progress, 0.0-1.0.
+# They work on plain floats or numpy arrays alike.
+
+def ease_linear(progress):
+    """Constant rate of change from start to finish."""
+    return progress
+
+
+def ease_in(progress):
+    """Start slowly, and speed up toward the end."""
+    return progress * progress
+
+
+def ease_out(progress):
+    """Start quickly, and slow down toward the end."""
+    return progress * (2.0 - progress)
+
+
+def ease_in_out(progress):
+    """Start and end slowly, fastest in the middle (smoothstep)."""
+    return progress * progress * (3.0 - 2.0 * progress)
+
+
+FADE_EASING = {
+    'linear': ease_linear,
+    'ease_in': ease_in,
+    'ease_out': ease_out,
+    'ease_in_out': ease_in_out,
+}
+
+
+def easingCurve(easing):
+    """Return the curve for easing: the name of a curve in FADE_EASING, or
+    a function, returned as is.
     """
-    # "& 0xFF" is to make sure we're not exceeding max setting of 255
-    # 2018-08-22 This seems to have an error with Python 3
-    # rgb = numpy.array([red & 0xFF, green & 0xFF, blue & 0xFF])
-    rgb = numpy.array([red, green, blue])
-    return rgb
+    return FADE_EASING[easing] if isinstance(easing, str) else easing
+
+
+def fadeProgress(seconds):
+    """Generator of linear fade progress, 0.0-1.0, due at the current time
+    for a fade lasting seconds, ending on 1.0.
+    """
+    start_time = time.monotonic()
+    progress = 0.0
+    while progress < 1.0:
+        if seconds > 0:
+            progress = min(1.0, (time.monotonic() - start_time) / seconds)
+        else:
+            progress = 1.0
+        yield progress
+
+
+def _fadeFrame(start_colors, delta_colors, progress, work_colors, frame_colors):
+    """Return start_colors + delta_colors * progress, rounded into the uint8
+    frame_colors, using work_colors (float32, same shape) as scratch space.
+    """
+    numpy.multiply(delta_colors, progress, out=work_colors)
+    numpy.add(work_colors, start_colors, out=work_colors)
+    numpy.rint(work_colors, out=work_colors)
+    numpy.copyto(frame_colors, work_colors, casting='unsafe')
+    return frame_colors
+
+
+def fadeFrames(start_colors, new_colors, seconds, easing='linear'):
+    """Generator of the frames of a fade from start_colors to new_colors
+    (each a pixel count by 3 (RGB) array), yielding the frame due at the
+    current time, until the last one is new_colors. Every frame is the same
+    uint8 array, so copy one to keep it.
+    """
+    curve = easingCurve(easing)
+    start_colors = numpy.asarray(start_colors, dtype=numpy.float32)
+    delta_colors = numpy.asarray(new_colors, dtype=numpy.float32) - start_colors
+    work_colors = numpy.empty_like(start_colors)
+    frame_colors = pixelcolor.newFrame(len(start_colors))
+    for progress in fadeProgress(seconds):
+        yield _fadeFrame(start_colors, delta_colors, curve(progress), work_colors, frame_colors)
+
+
+#####
+#
+# SuperPixel - superset pixel strand class
+#
+#####
+
+def _dimmerLevel(brightness):
+    """Return a dimmer setting as an int, clamped to 0-255."""
+    return min(255, max(0, int(brightness)))
+
+
+# Colors are uint8 [R, G, B] arrays, and pixel buffers are uint8 arrays of
+# [R, G, B] rows (see pixelcolor.py). The SuperPixel's buffer is the only
+# copy of the frame: each sub-strand converts its share to its own internal
+# representation when it's shown.
+
+
+class _OutputWorker(object):
+    def __init__(self, strand, name):
+        """Thread which shows one sub-strand whenever start() is called, so
+        sub-strands on independent hardware can send at the same time.
+        """
+        self._strand = strand
+        self._go = threading.Event()
+        self._done = threading.Event()
+        self._error = None
+        self.show_seconds = 0.0
+        self.done_time = 0.0
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def start(self):
+        """Start showing the strand."""
+        self._done.clear()
+        self._go.set()
+
+    def wait(self):
+        """Wait for the show started by start() to finish, raising anything
+        it raised.
+        """
+        self._done.wait()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def stop(self):
+        """End the thread."""
+        self._strand = None
+        self._go.set()
+
+    def _run(self):
+        while True:
+            self._go.wait()
+            self._go.clear()
+            strand = self._strand
+            if strand is None:
+                return
+            start_time = time.perf_counter()
+            try:
+                strand.show()
+            except Exception as error:
+                self._error = error
+            self.done_time = time.perf_counter()
+            self.show_seconds = self.done_time - start_time
+            self._done.set()
 
 
 class SuperPixel(object):
-    def __init__(self, *strands):
+    def __init__(self, *strands, concurrent=True):
         """Class to represent a superset of both neopixel and paleopixel strands
 
-        strands - Variable argument list of sub-strands which should make up
-                  the one SuperPixel strand. The sub-strands are added to the
-                  super-strand in the order the arguments are listed.
+        strands    - Variable argument list of sub-strands which should make
+                     up the one SuperPixel strand. The sub-strands are added
+                     to the super-strand in the order the arguments are
+                     listed. Sub-strands which share one render call, such
+                     as both channels of one Adafruit_NeoPixel (see
+                     addChannel), are shown with a single show().
+        concurrent - bool, show the sub-strands all at once, each from its
+                     own output thread, rather than one after another; also
+                     lets show(block=False) return while the frame is sent
         """
         self._strands = strands
+
+        # Sub-strands grouped by the object whose show() sends them out (a
+        # sub-strand's renderOwner(), or else the sub-strand itself), as
+        # (render owner, [sub-strand indices]), in sub-strand order
+        self._output_groups = []
+        for strand_index, strand in enumerate(self._strands):
+            owner = strand.renderOwner() if hasattr(strand, 'renderOwner') else strand
+            for group_owner, group_strands in self._output_groups:
+                if group_owner is owner:
+                    group_strands.append(strand_index)
+                    break
+            else:
+                self._output_groups.append((owner, [strand_index]))
+
+        # Build the routing table once, so we never have to search the
+        # sub-strands (or ask them for their length) when setting a pixel.
+        # _strand_slices: (start, stop) global pixel range for each sub-strand
+        # _pixel_strand:  sub-strand index that owns each global pixel
+        # _pixel_local:   pixel offset within that sub-strand
+        self._strand_slices = []
         pixel_count = 0
         for strand in self._strands:
-            pixel_count = pixel_count + strand.numPixels()
-
-        # Create an array for all of the LED color data:
-        # 2D numpyarray, LED count by 3 (RGB), type int
-        self._led_data = numpy.zeros((pixel_count, 3), dtype=numpy.int)
+            strand_count = strand.numPixels()
+            self._strand_slices.append((pixel_count, pixel_count + strand_count))
+            pixel_count = pixel_count + strand_count
+
+        self._pixel_strand = numpy.zeros(pixel_count, dtype=numpy.intp)
+        self._pixel_local = numpy.zeros(pixel_count, dtype=numpy.intp)
+        for strand_index, (start, stop) in enumerate(self._strand_slices):
+            self._pixel_strand[start:stop] = strand_index
+            self._pixel_local[start:stop] = numpy.arange(stop - start)
+
+        # Same table as Python objects, for O(1) single-pixel dispatch
+        self._pixel_route = list(zip(self._pixel_strand.tolist(), self._pixel_local.tolist()))
+
+        # Dirty range per sub-strand, as local (start, stop) pixels changed
+        # since it was last shown, or None if it is unchanged
+        self._dirty = [None] * len(self._strands)
+
+        # RenderLoop which owns show(), if any
+        self._render_loop = None
+
+        # Output threads, one for each output group, or None to show in
+        # turn. A blocking show() sends the first group from its own thread.
+        # _pending: (group index, encode seconds) still being sent
+        self._output_workers = None
+        if concurrent:
+            self._output_workers = [_OutputWorker(owner, 'SuperPixelOutput-{0}'.format(group_index))
+                                    for group_index, (owner, group_strands) in enumerate(self._output_groups)]
+        self._pending = []
+
+        # Metrics names for the time in each output group's show()
+        self._group_names = ['show.{0}.{1}'.format('+'.join(str(index) for index in group_strands),
+                                                   type(owner).__name__)
+                             for owner, group_strands in self._output_groups]
+
+        # The framebuffer, double buffered: LED count by 3 (RGB), uint8.
+        # _led_data:   the back buffer, where every write lands
+        # _front_data: the frame being sent; show() latches the changed part
+        #              of the back buffer into it, then encodes it to the
+        #              sub-strands
+        # _buffer_lock guards the back buffer and its dirty ranges, so a
+        # frame is latched between writes, never in the middle of one, and
+        # _show_lock keeps one show() (or output stage change) at a time.
+        self._led_data = pixelcolor.newFrame(pixel_count)
+        self._front_data = pixelcolor.newFrame(pixel_count)
+        self._buffer_lock = threading.RLock()
+        self._show_lock = threading.RLock()
+
+        # Output stage, applied as the framebuffer is encoded (see
+        # setBrightness, setZoneBrightness and setStrandOutput):
+        # _brightness:    global master dimmer, 0-255
+        # _zones:         name: [pixel indices, dimmer 0-255]
+        # _dimmer_offset: each pixel's combined zone dimmer * 256, its row
+        #                 in an output table
+        # _strand_gamma, _strand_order: gamma and RGB channel order for each
+        #                 sub-strand
+        # _output_tables: flattened pixelcolor.outputTable() for each
+        #                 sub-strand, or None where output is unchanged
+        self._brightness = 255
+        self._zones = {}
+        self._dimmer_offset = numpy.full(pixel_count, 255 * 256, dtype=numpy.intp)
+        self._strand_gamma = [1.0] * len(self._strands)
+        self._strand_order = [[0, 1, 2]] * len(self._strands)
+        self._output_tables = [None] * len(self._strands)
+        # Scratch space for the output pass, and the frame as sent
+        self._output_index = numpy.empty((pixel_count, 3), dtype=numpy.intp)
+        self._output_data = pixelcolor.newFrame(pixel_count)
 
     def __del__(self):
         # Clean up memory used by the library when not needed anymore.
+        if self._output_workers is not None:
+            for worker in self._output_workers:
+                worker.stop()
+            self._output_workers = None
         if self._led_data is not None:
             self._led_data = None
         if self._strands is not None:
@@ -92,37 +328,253 @@ class SuperPixel(object):
         """
         for strand in self._strands:
             strand.begin()
-        self.show()
+        self.show(force=True)
+
+    def show(self, force=False, block=True):
+        """Update the display with the data from the LED buffer.
+
+        Only sub-strands that have changed since they were last shown are
+        sent out again, and only their changed range is encoded from the
+        framebuffer, so calling show() repeatedly (as several PixelGrids on
+        the same SuperPixel will) costs nothing once the frame is out.
+        Pass force=True to encode and show every sub-strand in full; this
+        also overwrites any changes made directly to a sub-strand.
+
+        Drawing goes into the back buffer. show() latches it into the front
+        buffer at the frame boundary, in one copy of the changed ranges, and
+        sends the front buffer, so threads still drawing can't tear a frame
+        on its way out.
+
+        With concurrent output (the default), the sub-strands all start
+        sending at once, and show() returns when the slowest is done, so a
+        frame costs the longest sub-strand's time rather than their sum, and
+        still goes out as one frame. With block=False, show() returns as
+        soon as the frame is latched and handed to the output threads, so
+        the next frame can be drawn while this one is on the wire; the next
+        show() waits for it to finish before latching.
+
+        While a RenderLoop is attached, calling show() from any other thread
+        only asks the render thread to send the frame out on its next tick.
+        """
+        render_loop = self._render_loop
+        if render_loop is not None and not render_loop.isRenderThread():
+            render_loop.requestShow(force)
+            return
+
+        with self._show_lock:
+            # The sub-strands' buffers are free again once the last frame is out
+            self._waitOutput()
+
+            # Latch the back buffer's changes into the front buffer
+            with self._buffer_lock:
+                dirty = self._dirty
+                self._dirty = [None] * len(self._strands)
+                if force:
+                    dirty = [(0, strand_stop - strand_start) for strand_start, strand_stop in self._strand_slices]
+                for strand_index, strand_dirty in enumerate(dirty):
+                    if strand_dirty is not None:
+                        strand_start = self._strand_slices[strand_index][0]
+                        start, stop = strand_start + strand_dirty[0], strand_start + strand_dirty[1]
+                        self._front_data[start:stop] = self._led_data[start:stop]
+
+            timing = METRICS.enabled
+            workers = self._output_workers
+            local = []  # (group index, seconds spent encoding it)
+            for group_index, (owner, group_strands) in enumerate(self._output_groups):
+                if all(dirty[strand_index] is None for strand_index in group_strands):
+                    continue
+                if timing:
+                    start_time = time.perf_counter()
+                for strand_index in group_strands:
+                    if dirty[strand_index] is not None:
+                        self._encodeStrand(strand_index, self._strands[strand_index],
+                                           dirty[strand_index][0], dirty[strand_index][1])
+                encode_seconds = time.perf_counter() - start_time if timing else 0.0
+                if workers is not None and (group_index > 0 or not block):
+                    # Start sending it from its own thread right away
+                    workers[group_index].start()
+                    self._pending.append((group_index, encode_seconds))
+                else:
+                    local.append((group_index, encode_seconds))
+
+            # Send the rest from this thread
+            for group_index, encode_seconds in local:
+                start_time = time.perf_counter()
+                # Each strand knows how to show itself (and any sub-strands
+                # sharing its render).
+                self._output_groups[group_index][0].show()
+                if timing:
+                    METRICS.record(self._group_names[group_index],
+                                   encode_seconds + time.perf_counter() - start_time)
+            if block:
+                self._waitOutput()
+            if timing and local and not self._pending:
+                # Out already; otherwise _waitOutput() notes it once it is
+                METRICS.frameShown()
+
+    def _waitOutput(self):
+        """Wait for the output threads to finish sending, raising the first
+        error any of them had. Once they are done, the frame they were
+        sending counts as shown, as of when the last of them finished.
+        """
+        pending, self._pending = self._pending, []
+        first_error = None
+        done_time = 0.0
+        for group_index, encode_seconds in pending:
+            worker = self._output_workers[group_index]
+            try:
+                worker.wait()
+            except Exception as error:
+                first_error = first_error or error
+            done_time = max(done_time, worker.done_time)
+            if METRICS.enabled:
+                METRICS.record(self._group_names[group_index], encode_seconds + worker.show_seconds)
+        if first_error is not None:
+            raise first_error
+        if pending and METRICS.enabled:
+            METRICS.frameShown(done_time)
+
+    def concurrentOutput(self):
+        """Return True if the sub-strands are shown all at once."""
+        return self._output_workers is not None
+
+    def _encodeStrand(self, strand_index, strand, start, stop):
+        """Write the front buffer's colors for a sub-strand's local pixels
+        start up to (not including) stop into the sub-strand.
+        """
+        strand_start = self._strand_slices[strand_index][0]
+        start, stop = strand_start + start, strand_start + stop
+        strand_colors = self._front_data[start:stop]
+        output_table = self._output_tables[strand_index]
+        if output_table is not None:
+            # One lookup for every channel of every pixel:
+            # output_table[dimmer row + value], in the strand's channel order
+            output_index = self._output_index[start:stop]
+            dimmer_offset = self._dimmer_offset[start:stop]
+            for channel, source_channel in enumerate(self._strand_order[strand_index]):
+                numpy.add(strand_colors[:, source_channel], dimmer_offset, out=output_index[:, channel])
+            strand_colors = self._output_data[start:stop]
+            numpy.take(output_table, output_index, out=strand_colors)
+        start, stop = start - strand_start, stop - strand_start
+        if hasattr(strand, 'setRange'):
+            strand.setRange(start, stop, strand_colors)
+        else:
+            for pixel, rgb in enumerate(strand_colors.tolist(), start):
+                strand.setPixelColorRGB(pixel, rgb[0], rgb[1], rgb[2])
 
-    def show(self):
-        """Update the display with the data from the LED buffer."""
-        for strand in self._strands:
-            # Each strand knows how to show itself.
-            strand.show()
+    def setBrightness(self, brightness):
+        """Set the master dimmer for every pixel, 0-255, applied at output
+        time. Pixel colors themselves are left as they are.
+        """
+        self._brightness = _dimmerLevel(brightness)
+        self._updateOutputTables()
+
+    def getBrightness(self):
+        """Return the master dimmer, 0-255."""
+        return self._brightness
+
+    def addZone(self, name, indices, brightness=255):
+        """Name a set of pixels (such as a PixelGrid's pixelIndices()) as a
+        zone with its own dimmer. Zones may overlap; a pixel in several is
+        dimmed by each of them.
+        indices: pixel positions
+        """
+        self._zones[name] = [numpy.asarray(indices, dtype=numpy.intp), _dimmerLevel(brightness)]
+        self._updateDimmers()
+
+    def setZoneBrightness(self, name, brightness):
+        """Set the dimmer for a zone, 0-255, applied at output time."""
+        self._zones[name][1] = _dimmerLevel(brightness)
+        self._updateDimmers()
+
+    def zoneBrightness(self, name):
+        """Return the dimmer for a zone, 0-255."""
+        return self._zones[name][1]
+
+    def zonePixels(self, name):
+        """Return the array of pixel positions in a zone, as kept since it
+        was last added.
+        """
+        return self._zones[name][0]
+
+    def setStrandOutput(self, strand_index, gamma=None, color_order=None):
+        """Set how a sub-strand's colors are corrected at output time.
+        gamma:       float, 1.0 for none; around 2.2 for most LEDs
+        color_order: str, such as 'RGB' or 'GRB', the order to hand channels
+                     to the sub-strand in, for pixels wired differently
+                     than the sub-strand expects
+        """
+        if gamma is not None:
+            self._strand_gamma[strand_index] = float(gamma)
+        if color_order is not None:
+            if sorted(color_order) != ['B', 'G', 'R']:
+                raise ValueError('color_order must be an order of R, G and B: {0}'.format(color_order))
+            self._strand_order[strand_index] = ['RGB'.index(channel) for channel in color_order]
+        self._updateOutputTables()
+
+    def _updateDimmers(self):
+        """Combine the zone dimmers into each pixel's dimmer."""
+        dimmers = numpy.ones(len(self._led_data))
+        for indices, brightness in self._zones.values():
+            dimmers[indices] *= brightness / 255.0
+        with self._show_lock:
+            numpy.multiply(numpy.rint(dimmers * 255.0).astype(numpy.intp), 256, out=self._dimmer_offset)
+            self._updateOutputTables()
+
+    def _updateOutputTables(self):
+        """Rebuild each sub-strand's output table, and send every pixel out
+        again at the next show().
+        """
+        full_dimmer = 255 * 256
+        with self._show_lock:
+            for strand_index, (start, stop) in enumerate(self._strand_slices):
+                gamma = self._strand_gamma[strand_index]
+                if (gamma == 1.0 and self._brightness == 255 and self._strand_order[strand_index] == [0, 1, 2]
+                        and (self._dimmer_offset[start:stop] == full_dimmer).all()):
+                    self._output_tables[strand_index] = None  # output is the framebuffer as is
+                else:
+                    self._output_tables[strand_index] = pixelcolor.outputTable(gamma, self._brightness).ravel()
+            self.markDirty()
+
+    def attachRenderLoop(self, render_loop):
+        """Hand show() over to a RenderLoop's thread, or back to the caller
+        with None. See renderloop.RenderLoop.
+        """
+        self._render_loop = render_loop
+
+    def markDirty(self, start=0, stop=None):
+        """Flag pixels start up to (not including) stop as changed, so the
+        next show() sends their sub-strands out again. Defaults to all pixels.
+        """
+        if stop is None:
+            stop = len(self._led_data)
+        with self._buffer_lock:
+            for strand_index, (strand_start, strand_stop) in enumerate(self._strand_slices):
+                range_start = max(start, strand_start)
+                range_stop = min(stop, strand_stop)
+                if range_start < range_stop:
+                    self._markStrandDirty(strand_index, range_start - strand_start, range_stop - strand_start)
+
+    def dirtyRanges(self):
+        """Return a list with the local (start, stop) range of pixels changed
+        since the last show() for each sub-strand, or None where unchanged.
+        """
+        return list(self._dirty)
+
+    def _markStrandDirty(self, strand_index, start, stop):
+        """Grow the dirty range of one sub-strand to cover start:stop."""
+        dirty = self._dirty[strand_index]
+        if dirty is None:
+            self._dirty[strand_index] = (start, stop)
+        else:
+            self._dirty[strand_index] = (min(dirty[0], start), max(dirty[1], stop))
 
     def setPixelColor(self, n, color_rgb):
         """Set LED at position n to the provided numpy array [R, G, B].
         n: int
         color: numpy.array, as [R, G, B]
         """
-        if (n >= len(self._led_data)):
-            return  # pixel 'n' is out of bounds; throw it away
-
-        # SuperPixel internal representation:
-        self._led_data[n] = color_rgb
-
-        # Now also set it in the sub-strand
-        pixel_offset = 0
-        pixel_max = 0
-        for strand in self._strands:
-            # Determine which strand this pixel is a part of, and set it.
-            pixel_max = pixel_offset + strand.numPixels()
-            if (pixel_offset <= n) and (n < pixel_max):
-                pixel = n - pixel_offset
-                strand.setPixelColorRGB(pixel, color_rgb[0].item(), color_rgb[1].item(), color_rgb[2].item())
-                break
-            else:  # Must be in the next one
-                pixel_offset = pixel_offset + strand.numPixels()
+        self.setPixelColorRGB(n, color_rgb[0], color_rgb[1], color_rgb[2])
 
     def setPixelColorRGB(self, n, red, green, blue):
         """Set LED at position n to the provided red, green, and blue color.
@@ -131,12 +583,25 @@ class SuperPixel(object):
         n: int, pixel location
         red, green, blue: int, 0-255
         """
-        self.setPixelColor(n, Color(red, green, blue))
-        # self.setPixelColor(n, red, green, blue)
+        if (n >= len(self._pixel_route)):
+            return  # pixel 'n' is out of bounds; throw it away
+        timing = METRICS.enabled
+        if timing:
+            start_time = time.perf_counter()
+
+        # The sub-strand that owns it picks it up at the next show()
+        strand_index, pixel = self._pixel_route[n]
+        with self._buffer_lock:
+            self._led_data[n] = (red, green, blue)
+            self._markStrandDirty(strand_index, pixel, pixel + 1)
+
+        if timing:
+            METRICS.record('routing', time.perf_counter() - start_time)
 
     def getPixels(self):
-        """Return an object which allows access to the LED display data as if
-        it were a sequence of 24-bit RGB values.
+        """Return the framebuffer (the back buffer, being drawn), as a pixel
+        count by 3 (RGB) uint8 array. Write to it through the set methods, or
+        call markDirty() after changing it directly.
         """
         return self._led_data
 
@@ -150,29 +615,124 @@ class SuperPixel(object):
         """
         return self._led_data[n]
 
-    def fade_to_colors(self, new_colors, seconds):
+    def setPixels(self, colors):
+        """Set every LED from an array of [R, G, B] rows, one row per pixel.
+        colors: numpy.array, pixel count by 3 (RGB)
+        """
+        self.setRange(0, len(self._led_data), colors)
+
+    def setRange(self, start, stop, colors):
+        """Set LEDs from start up to (not including) stop, in one slice of
+        the framebuffer.
+        colors: numpy.array, either one [R, G, B] for the whole range, or
+                (stop - start) by 3 (RGB)
+        """
+        clipped = pixelcolor.clipRange(start, stop, colors, len(self._led_data))
+        if clipped is None:
+            return  # out of bounds; throw it away
+        timing = METRICS.enabled
+        if timing:
+            start_time = time.perf_counter()
+        start, stop, colors = clipped
+        with self._buffer_lock:
+            self._led_data[start:stop] = colors
+            self.markDirty(start, stop)
+
+        if timing:
+            METRICS.record('routing', time.perf_counter() - start_time)
+
+    def setPixelsAt(self, indices, colors):
+        """Set the LEDs at an array of pixel positions, in one scatter into the
+        framebuffer.
+        indices: numpy.array of int pixel positions
+        colors:  numpy.array, either one [R, G, B] for every position, or
+                 len(indices) by 3 (RGB)
+        """
+        timing = METRICS.enabled
+        if timing:
+            start_time = time.perf_counter()
+        indices, colors = pixelcolor.clipIndices(indices, colors, len(self._led_data))
+        if len(indices) == 0:
+            return
+
+        strand_of_pixel = self._pixel_strand[indices]
+        with self._buffer_lock:
+            self._led_data[indices] = colors
+            for strand_index in range(len(self._strands)):
+                local_pixels = self._pixel_local[indices[strand_of_pixel == strand_index]]
+                if len(local_pixels) == 0:
+                    continue  # this sub-strand isn't touched
+                self._markStrandDirty(strand_index, int(local_pixels.min()), int(local_pixels.max()) + 1)
+
+        if timing:
+            METRICS.record('routing', time.perf_counter() - start_time)
+
+    def fill(self, color):
+        """Set all LEDs to the provided color as [R, G, B]."""
+        self.setRange(0, len(self._led_data), color)
+
+    def fade_to_colors(self, new_colors, seconds, easing='linear', paced=True):
         """Fade from the current pixel colors to a new list of
         pixel color values, over a float number of seconds.
+
+        Each frame is interpolated from the starting colors in one array
+        operation, and frames are paced against the clock at FADE_FPS. If
+        rendering falls behind, frames are dropped so the fade still finishes
+        on time.
+
+        new_colors - numpy.array, pixel count by 3 (RGB)
+        seconds    - float, duration of the fade
+        easing     - name of a curve in FADE_EASING, or a function mapping
+                     progress 0.0-1.0 to eased progress 0.0-1.0
+        paced      - False to show every frame back to back, without waiting
+                     for its time (for benchmarks)
         """
-        frame_delay = 1.0 / FADE_FPS
-        # print("frame_delay", frame_delay)
+        target_colors = numpy.asarray(new_colors, dtype=numpy.float32)
         frames = int(FADE_FPS * seconds)
-        # print("frames", frames)
-        for frame in range(frames):
-            frames_remain = frames - frame
-            current_colors = self._led_data
-            for index, current_rgb in enumerate(current_colors):
-                new_rgb = []
-                for color in range(3):
-                    delta = current_rgb[color] - new_colors[index][color]
-                    if delta != 0 and frames_remain != 0:
-                        delta_frame = int(delta / frames_remain)
-                        new_rgb.append(current_rgb[color] - delta_frame)
-                    else:
-                        new_rgb.append(current_rgb[color])
-                self.setPixelColor(index, new_rgb)
+        if frames < 1:
+            self.setPixels(target_colors)
+            self.show()
+            return
+
+        curve = easingCurve(easing)
+        start_colors = self._led_data.astype(numpy.float32)
+        delta_colors = target_colors - start_colors
+        work_colors = numpy.empty_like(start_colors)
+        frame_colors = numpy.empty_like(self._led_data)
+        frame_delay = 1.0 / FADE_FPS
+
+        start_time = time.monotonic()
+        frame = 0
+        while frame < frames:
+            if not paced:
+                frame += 1
+                self.setPixels(_fadeFrame(start_colors, delta_colors, curve(frame / frames), work_colors, frame_colors))
+                self.show()
+                continue
+
+            # Jump to whichever frame is due now, skipping any we're late for
+            elapsed = time.monotonic() - start_time
+            next_frame = min(frames, max(frame + 1, int(elapsed / frame_delay) + 1))
+            if METRICS.enabled and next_frame > frame + 1:
+                METRICS.count('fade.dropped', next_frame - frame - 1)
+            frame = next_frame
+            progress = curve(frame / frames)
+            self.setPixels(_fadeFrame(start_colors, delta_colors, progress, work_colors, frame_colors))
             self.show()
-            # time.sleep(frame_delay)
+
+            remaining = start_time + frame * frame_delay - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def fadeSteps(self, new_colors, seconds, easing='linear'):
+        """Generator version of fade_to_colors, for the EffectScheduler or a
+        RenderLoop: each step draws the fade frame due at the current time,
+        then yields None, until the fade is done. Showing the frames, and
+        pacing them, is left to the caller.
+        """
+        for frame_colors in fadeFrames(self._led_data, new_colors, seconds, easing):
+            self.setPixels(frame_colors)
+            yield None
 
 
 #####
@@ -198,51 +758,43 @@ class PixelGrid(object):
                                  negative values representing a count backwards
                                  up the strand (to account for zig-zag layouts)
 
-        Internal representation: [row][column][strand_pixel, R, G, B]
-
-        WORK IN PROGRESS
+        Internal representation:
+            _index_map - [row][column] strand pixel for each grid cell
+            _mask      - [row][column] True where the cell is a real pixel;
+                         rows shorter than the widest row are masked off at
+                         the end, and never touch the strand
+
+        A grid keeps no colors of its own: it is a view of the strand's
+        pixels, so any number of grids can share one SuperPixel, and reads
+        always see the latest writes. Row, region and whole-grid setters are
+        each one scatter into the strand, through its setPixelsAt() if it has
+        one.
         """
-        # TODO: Convert to numpy 3D array
-        # TODO: Would this be more ifficient if I grabbed the strand pixel as
-        #       an object, and there was no internal grid representation?
         self._strand = strand
+        self._segments = segments
         # Find maximum row width
         max_width = 0
         for segment in segments:
             row_width = abs(segment[1])
             if row_width > max_width:
                 max_width = row_width
-        # Create an empty grid array
-        self._grid = numpy.zeros(shape=(len(segments), max_width, 4), dtype=numpy.int)
-        # print("_grid: ", self._grid.shape)
 
-        # Load up the grid with pixel location data
-        row = 0
-        for segment in segments:
-            # print("segment: ", segment)
-            # Create map
-            start_pixel = segment[0]
-            stop_pixel = segment[0] + segment[1]
-            if (segment[1] < 0):
-                step = -1
-            else:
-                step = 1
-            column = 0
-            for pixel in range(start_pixel, stop_pixel, step):
-                self._grid[row][column] = [pixel, 0, 0, 0]
-                column = column + 1
-            row = row + 1
-        # print("_grid: ", self._grid)
+        # Load up the index map with pixel location data
+        self._index_map = numpy.zeros((len(segments), max_width), dtype=numpy.intp)
+        self._mask = numpy.zeros((len(segments), max_width), dtype=bool)
+        for row, (start_pixel, length) in enumerate(segments):
+            step = -1 if length < 0 else 1
+            self._index_map[row, :abs(length)] = numpy.arange(start_pixel, start_pixel + length, step)
+            self._mask[row, :abs(length)] = True
+        self._row_lengths = [abs(segment[1]) for segment in segments]
 
-        # TODO: trim the rows that are smaller than max_width
-        # How do we do this without accidentally trimming the 0th pixel?
+        # Strand pixels for every real cell, in row-major order
+        self._pixel_indices = self._index_map[self._mask]
 
     def __del__(self):
         # Clean up memory used by the library when not needed anymore.
         if self._strand is not None:
             self._strand = None
-        if self._grid is not None:
-            self._grid = None
 
     def begin(self):
         """Initialize _led_data to zeroes and set up any NeoPixels
@@ -254,20 +806,27 @@ class PixelGrid(object):
         """Update the display with the data from the LED buffer."""
         self._strand.show()
 
+    def _scatter(self, cells, colors):
+        """Set the strand pixels of the grid cells selected by the boolean
+        array cells to colors: one [R, G, B], or one [R, G, B] per cell.
+        """
+        indices = self._index_map[cells]
+        if hasattr(self._strand, 'setPixelsAt'):
+            self._strand.setPixelsAt(indices, colors)
+        else:
+            colors = numpy.broadcast_to(pixelcolor.toColors(colors), (len(indices), 3))
+            for pixel, rgb in zip(indices.tolist(), colors.tolist()):
+                self._strand.setPixelColorRGB(pixel, rgb[0], rgb[1], rgb[2])
+
     def setPixelColor(self, x=0, y=0, color_rgb=None):
-        """Set LED at position x, y to the provided 24-bit color value (in RGB order).
+        """Set LED at position x, y to the provided color as [R, G, B].
         """
-        if (y >= len(self._grid)):
+        if (y < 0 or x < 0 or y >= len(self._row_lengths)):
             return  # out of bounds; throw it away
-        elif (x >= len(self._grid[y])):
+        elif (x >= self._row_lengths[y]):
             return  # We have to check the specific row because y isn't constant
 
-        # Grid internal representation:
-        self._grid[y][x][1], self._grid[y][x][2], self._grid[y][x][3] = color_rgb
-
-        # Now also set it in the strand
-        self._strand.setPixelColorRGB(self._grid[y][x][0].item(), self._grid[y][x][1], self._grid[y][x][2],
-                                      self._grid[y][x][3])
+        self._strand.setPixelColorRGB(int(self._index_map[y, x]), color_rgb[0], color_rgb[1], color_rgb[2])
 
     def setPixelColorRGB(self, x, y, red, green, blue):
         """Set LED at position n to the provided red, green, and blue color.
@@ -278,34 +837,68 @@ class PixelGrid(object):
         # print("> About to call setPixelColor({}, {}, {})", x, y, color_rgb)
         self.setPixelColor(x=x, y=y, color_rgb=color_rgb)
 
+    def setRow(self, row, color):
+        """Set all LEDs in a row to the provided color as [R, G, B]."""
+        cells = numpy.zeros_like(self._mask)
+        cells[row] = self._mask[row]
+        self._scatter(cells, color)
+
+    def setAll(self, color):
+        """Set all LEDs to the provided color as [R, G, B]."""
+        self._scatter(self._mask, color)
+
+    def setRegion(self, x0, y0, x1, y1, color):
+        """Set the LEDs from column x0 up to (not including) x1, on rows y0 up
+        to (not including) y1, to the provided color as [R, G, B].
+        """
+        cells = numpy.zeros_like(self._mask)
+        cells[y0:y1, x0:x1] = self._mask[y0:y1, x0:x1]
+        self._scatter(cells, color)
+
+    def blit(self, frame):
+        """Copy a frame of [row][column][R, G, B] colors onto the grid, from
+        the upper left. Parts of the frame outside the grid are ignored, and
+        grid cells outside the frame are left as they are.
+        frame: numpy.array, height by width by 3 (RGB)
+        """
+        frame = numpy.asarray(frame)
+        height = min(frame.shape[0], self._mask.shape[0])
+        width = min(frame.shape[1], self._mask.shape[1])
+        cells = numpy.zeros_like(self._mask)
+        cells[:height, :width] = self._mask[:height, :width]
+        self._scatter(cells, frame[:height, :width][cells[:height, :width]])
+
+    def setPixels(self, colors):
+        """Set every LED in the grid from an array of [R, G, B] rows, one for
+        each cell in the same order as pixelIndices(): row by row, left to
+        right.
+        colors: numpy.array, numPixels() by 3 (RGB)
+        """
+        self._scatter(self._mask, colors)
+
     def setRowColor(self, row, color):
         """Set all row LEDs to the provided color values as [R, G, B]
         """
-        # TODO: Seems like there may be a more efficient way to do this in numpy
-        for x in range(len(self._grid[row])):
-            self.setPixelColor(x, row, color)
+        self.setRow(row, color)
 
     def setRowColorRGB(self, row, red, green, blue):
         """Set all LEDs to the provided red, green, and blue color.
         Each color component should be a value from 0 to 255 (where 0 is the
         lowest intensity and 255 is the highest intensity).
         """
-        self.setRowColor(row, Color(red, green, blue))
+        self.setRow(row, Color(red, green, blue))
 
     def setAllColor(self, color):
         """Set all LEDs to the provided color values as [R, G, B]
         """
-        # TODO: Seems like there may be a more efficient way to do this in numpy
-        for y in range(len(self._grid)):
-            for x in range(len(self._grid[y])):
-                self.setPixelColor(x, y, color)
+        self.setAll(color)
 
     def setAllColorRGB(self, red, green, blue):
         """Set all LEDs to the provided red, green, and blue color.
         Each color component should be a value from 0 to 255 (where 0 is the
         lowest intensity and 255 is the highest intensity).
         """
-        self.setAllColor(Color(red, green, blue))
+        self.setAll(Color(red, green, blue))
 
     def getPixels(self):
         """Return the grid matrix as a 3D list.
@@ -315,32 +908,68 @@ class PixelGrid(object):
         return self.getGrid()
 
     def getGrid(self):
-        """Return the grid matrix as a 3D list.
+        """Return the grid matrix as a 3D array of [strand_pixel, R, G, B],
+        with colors read from the strand. Cells past the end of a short row
+        have a strand_pixel of -1, and are black.
+        """
+        strand_pixels = numpy.where(self._mask, self._index_map, -1)
+        colors = numpy.zeros(self._mask.shape + (3,), dtype=pixelcolor.COLOR_DTYPE)
+        colors[self._mask] = self._strandColors()[self._pixel_indices]
+        return numpy.dstack((strand_pixels, colors))
+
+    def _isPacked(self):
+        """Return True if the strand holds packed 24-bit colors, in its own
+        channel order, rather than [R, G, B] rows: a bare NeoPixel strand.
         """
-        return self._grid
+        return isinstance(self._strand, (neopixel.Adafruit_NeoPixel, neopixel.NeoPixelChannel))
+
+    def _strandColors(self):
+        """Return the strand's pixels as [R, G, B] rows."""
+        if self._isPacked():
+            return pixelcolor.unpack(self._strand.getPixels()[:], self._strand._color_order)
+        return pixelcolor.toColors(self._strand.getPixels())
+
+    def indexMap(self):
+        """Return the [row][column] array of strand pixels for each cell."""
+        return self._index_map
+
+    def mask(self):
+        """Return the [row][column] boolean array of cells that are pixels."""
+        return self._mask
+
+    def pixelIndices(self):
+        """Return the strand pixel of every cell in the grid, row by row."""
+        return self._pixel_indices
+
+    def onStrand(self, strand):
+        """Return a PixelGrid with the same segments, on another strand with
+        the same pixel numbering (such as a compositor Layer).
+        """
+        return PixelGrid(strand, *self._segments)
 
     def numRows(self):
         """Return the number of rows in the grid"""
-        return len(self._grid)
+        return len(self._row_lengths)
+
+    def rowLength(self, row):
+        """Return the number of pixels in a row"""
+        return self._row_lengths[row]
 
     def shape(self):
         """Return the shape of the grid"""
-        # print("shape:", self._grid.shape)
-        return self._grid.shape
+        return (self._mask.shape[0], self._mask.shape[1], 4)
 
     def numPixels(self):
         """Return the number of pixels in the display."""
-        pixel_count = 0
-        for row in self._grid:
-            pixel_count = pixel_count + len(row)
-        return pixel_count
+        return len(self._pixel_indices)
 
     def getPixelColor(self, x, y):
         """Get the [R, G, B] color value array for the LED at position x, y."""
-        red = self._grid[y][x][1]
-        green = self._grid[y][x][2]
-        blue = self._grid[y][x][3]
-        return [red, green, blue]
+        color = self._strand.getPixelColor(int(self._index_map[y, x]))
+        if self._isPacked():
+            color = pixelcolor.unpack(color, self._strand._color_order)
+        red, green, blue = color
+        return [int(red), int(green), int(blue)]
 
 
 #####
@@ -358,8 +987,35 @@ class PixelGrid(object):
 #
 #####
 
+def _player_cache_file(file, grid):
+    """Return the cache path (without extension) for a clip compiled for a
+    grid, keyed by the clip's path and modification time, and the grid's
+    shape and cell layout. Returns None if the clip can't be found, so it is
+    decoded (and fails to open) as it would be uncached.
+    """
+    path = os.path.abspath(file)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    key = hashlib.sha1()
+    key.update(path.encode('utf-8'))
+    key.update(repr(mtime).encode('utf-8'))
+    key.update(repr(grid.shape()).encode('utf-8'))
+    key.update(numpy.ascontiguousarray(grid.mask()).tobytes())
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(PLAYER_CACHE_DIR, name + '-' + key.hexdigest()[:16])
+
+
+def _make_cache_dir(cache_file):
+    """Create the directory for a cache file, if needed."""
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+
 class PixelPlayer(object):
-    def __init__(self, grid, file):
+    def __init__(self, grid, file, cache=True, mode='preload', buffer_frames=PLAYER_STREAM_FRAMES):
         """Class for playing video on a grid of LED pixels.
 
         grid - The PixelGrid that the video will be played on. We need to know
@@ -375,12 +1031,55 @@ class PixelPlayer(object):
         edge of the video frame. You may need to create a video in multiples of
         16x16 px, but any pixels outside the grid size will be ignored.
 
+        cache - If True, the compiled clip is saved in PLAYER_CACHE_DIR,
+                keyed by file path, modification time and grid layout, so
+                later loads skip decoding the video entirely.
+        mode  - How frames are held while playing:
+                'preload' - the whole compiled clip in memory (default)
+                'mmap'    - the compiled clip memory-mapped from the cache
+                            file, so memory use doesn't grow with clip length
+                            (always caches)
+                'stream'  - a decoder thread keeps a ring of buffer_frames
+                            compiled frames ahead of the playhead; nothing is
+                            cached, and only the ring is ever in memory
+        buffer_frames - int, size of the ring of frames in 'stream' mode
+
+        Long or looping clips, like the idle animations, should use 'mmap' or
+        'stream', and can be played with play(loop=True) until stop().
+
         WORK IN PROGRESS
         """
         self._grid = grid
-
-        vid = cv2.VideoCapture(file)
-
+        self._file = file
+        self._mode = mode
+        self._buffer_frames = buffer_frames
+        self._fps = None
+        self._frame_count = 0
+        self._frames = None
+        self._stop_event = threading.Event()
+
+        if mode == 'stream':
+            # Only read the clip's header; frames are decoded while playing
+            vid = cv2.VideoCapture(file)
+            self._readHeader(vid)
+            vid.release()
+            return
+        elif mode not in ('preload', 'mmap'):
+            raise ValueError('Unknown PixelPlayer mode: {0}'.format(mode))
+
+        cache_file = None
+        if cache or mode == 'mmap':
+            cache_file = _player_cache_file(file, grid)
+        if cache_file is not None:
+            self._loadCache(cache_file)
+        if self._frames is None:
+            self._decode(file, cache_file if mode == 'mmap' else None)
+            if cache_file is not None:
+                self._saveCache(cache_file)
+        self._frame_count = len(self._frames)
+
+    def _readHeader(self, vid):
+        """Read the frame count and frame rate of an opened clip."""
         if (vid.isOpened()):
             print("Opened video")
         else:
@@ -391,45 +1090,234 @@ class PixelPlayer(object):
         print("frameCount: " + str(frameCount))
         print("fps: " + str(fps))
 
-        waitPerFrameInSeconds = 1.0 / fps  # probably minus some overhead fudge factor
+        self._frame_count = max(frameCount, 0)  # -1 if it failed to open
+        if fps > 0:
+            self._fps = fps
+        else:
+            self._fps = PLAYER_DEFAULT_FPS  # container didn't say; assume
+
+    def _compileFrame(self, frameImg, frame_rgb, out):
+        """Compile one decoded frame into strand order, in out.
 
-        # Load the pixel data
-        # print("Loading video_data")
-        grid_shape = self._grid.shape()
-        self._video_data = numpy.zeros((frameCount, grid_shape[0], grid_shape[1], 3), dtype=numpy.int)
+        Crops the frame to the grid, and flips BGR to RGB, in one slice. The
+        grid may be bigger than the video, so the rest of frame_rgb (a
+        reusable [row][column][R, G, B] scratch buffer) stays black.
+        """
+        mask = self._grid.mask()
+        height = min(frameImg.shape[0], mask.shape[0])
+        width = min(frameImg.shape[1], mask.shape[1])
+        frame_rgb[:height, :width] = frameImg[:height, :width, ::-1]
+        out[:] = frame_rgb[mask]
+
+    def _decode(self, file, frames_file=None):
+        """Decode the clip with OpenCV, and compile it into strand order: for
+        each frame, the colors of every real grid cell, in the same order as
+        grid.pixelIndices(), so each frame plays back as a single bulk write.
+
+        If frames_file is given, the frames are compiled straight into a
+        memory-mapped .npy file there, instead of into memory.
+        """
+        vid = cv2.VideoCapture(file)
+        self._readHeader(vid)
+
+        mask = self._grid.mask()
+        frame_rgb = numpy.zeros(mask.shape + (3,), dtype=numpy.uint8)
+        frames_shape = (self._frame_count, numpy.count_nonzero(mask), 3)
+        if frames_file is not None:
+            _make_cache_dir(frames_file)
+            self._frames = numpy.lib.format.open_memmap(frames_file + '.npy', mode='w+',
+                                                        dtype=numpy.uint8, shape=frames_shape)
+        else:
+            self._frames = numpy.zeros(frames_shape, dtype=numpy.uint8)
 
-        frame_increment = 0
-        for frame in range(frameCount):
-            # Grabbing values from the frame tuple
+        for frame in range(self._frame_count):
             # 'ret' is a boolean for whether there's a frame at this index
             ret, frameImg = vid.read()
             if (ret):
-                for y in range(self._video_data.shape[1]):
-                    for x in range(self._video_data.shape[2]):
-                        try:  # grid may be bigger than video
-                            self._video_data[frame_increment][y][x] = [frameImg[y, x, 2], frameImg[y, x, 1],
-                                                                       frameImg[y, x, 0]]
-                        except IndexError:
-                            pass
-            frame_increment = frame_increment + 1
+                self._compileFrame(frameImg, frame_rgb, self._frames[frame])
         vid.release()
 
+    def _loadCache(self, cache_file):
+        """Load compiled frames from the disk cache, if they're there."""
+        try:
+            with open(cache_file + '.json') as meta_file:
+                meta = json.load(meta_file)
+            mmap_mode = 'r' if self._mode == 'mmap' else None
+            self._frames = numpy.load(cache_file + '.npy', mmap_mode=mmap_mode)
+            self._fps = meta['fps']
+            print("Loaded video from cache: " + cache_file)
+        except (IOError, OSError, ValueError, KeyError):
+            self._frames = None  # not cached yet (or unreadable); decode it
+
+    def _saveCache(self, cache_file):
+        """Save compiled frames to the disk cache. The metadata is written
+        last, so a half-written cache entry is never loaded.
+        """
+        try:
+            if isinstance(self._frames, numpy.memmap):
+                self._frames.flush()  # already compiled into the cache file
+            else:
+                _make_cache_dir(cache_file)
+                numpy.save(cache_file + '.npy', self._frames)
+            with open(cache_file + '.json', 'w') as meta_file:
+                json.dump({'fps': self._fps}, meta_file)
+        except (IOError, OSError) as error:
+            print("Could not cache video: " + str(error))
+
     def __del__(self):
         # Clean up memory used by the library when not needed anymore.
         if self._grid is not None:
             self._grid = None
-        if self._video_data is not None:
-            self._video_data = None
+        if self._frames is not None:
+            self._frames = None
+
+    def fps(self):
+        """Return the frame rate of the clip"""
+        return self._fps
+
+    def numFrames(self):
+        """Return the number of frames in the clip"""
+        return self._frame_count
+
+    def _storedFrames(self, loop):
+        """Generate compiled frames from memory, or the memory-mapped file."""
+        while True:
+            for frame in self._frames:
+                yield frame
+            if not loop or len(self._frames) == 0:
+                return
+
+    def _streamFrames(self, loop):
+        """Generate compiled frames from a decoder thread, which keeps a ring
+        of up to buffer_frames frames ahead of the playhead.
+        """
+        ring = queue.Queue(maxsize=self._buffer_frames)
+        finished = threading.Event()
+        decoder = threading.Thread(target=self._streamDecoder, args=(ring, loop, finished))
+        decoder.daemon = True
+        decoder.start()
+        try:
+            while True:
+                frame = ring.get()
+                if frame is None:
+                    return  # end of the clip
+                yield frame
+        finally:
+            finished.set()
+            decoder.join()
+
+    def _streamDecoder(self, ring, loop, finished):
+        """Decoder thread for 'stream' mode: decode and compile frames into
+        the ring until the clip ends (or forever, if looping), or until the
+        player is finished with it. A None in the ring marks the end.
+        """
+        vid = cv2.VideoCapture(self._file)
+        mask = self._grid.mask()
+        frame_rgb = numpy.zeros(mask.shape + (3,), dtype=numpy.uint8)
+        decoded = 0
+        while not finished.is_set():
+            ret, frameImg = vid.read()
+            if not ret:
+                if loop and decoded > 0:
+                    # Back to the start of the clip
+                    vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    decoded = 0
+                    continue
+                frame = None
+            else:
+                frame = numpy.zeros((numpy.count_nonzero(mask), 3), dtype=numpy.uint8)
+                self._compileFrame(frameImg, frame_rgb, frame)
+                decoded = decoded + 1
+
+            # Wait for room in the ring, but give up if playback has finished
+            while not finished.is_set():
+                try:
+                    ring.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if frame is None:
+                break
+        vid.release()
 
-    def play(self, delay=0):
-        """Plays the loaded data on the PixelGrid"""
-        # print ("Displaying video_data")
-        for frame in self._video_data:
-            for y in range(frame.shape[0]):
-                for x in range(frame.shape[1]):
-                    self._grid.setPixelColor(x, y, frame[y][x])
-            self._grid.show()
-            time.sleep(delay)
+    def playSteps(self, loop=False):
+        """Generator version of play, for the EffectScheduler or a
+        RenderLoop: each step draws the clip frame due at the current time,
+        then yields None, until the clip ends (or forever, with loop=True).
+        Showing the frames, and pacing them, is left to the caller.
+        """
+        if self._mode == 'stream':
+            frames = self._streamFrames(loop)
+        else:
+            frames = self._storedFrames(loop)
+
+        start_time = time.monotonic()
+        frame_index = 0
+        try:
+            for frame in frames:
+                self._grid.setPixels(frame)
+                yield None
+
+                # Skip any frames that came due while we were waiting
+                frame_index = frame_index + 1
+                due_index = int((time.monotonic() - start_time) * self._fps)
+                if METRICS.enabled and due_index > frame_index:
+                    METRICS.count('player.dropped', due_index - frame_index)
+                while frame_index < due_index:
+                    next(frames, None)
+                    frame_index = frame_index + 1
+        finally:
+            frames.close()
+
+    def stop(self):
+        """Stop playback, from another thread."""
+        self._stop_event.set()
+
+    def play(self, delay=None, loop=False):
+        """Plays the loaded data on the PixelGrid.
+
+        Frames are paced against the clock at the clip's own frame rate,
+        dropping any frame we're already late for, so the clip always runs
+        for its real length. Pass delay (seconds) to instead sleep a fixed
+        time after every frame.
+
+        With loop=True, the clip repeats until stop() is called.
+        """
+        self._stop_event.clear()
+        if self._mode == 'stream':
+            frames = self._streamFrames(loop)
+        else:
+            frames = self._storedFrames(loop)
+
+        frame_delay = 1.0 / self._fps
+        start_time = time.monotonic()
+        frame_index = 0
+        try:
+            for frame in frames:
+                if self._stop_event.is_set():
+                    break
+                self._grid.setPixels(frame)
+                self._grid.show()
+
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
+
+                # Sleep until the next frame is due, or skip the frames we're
+                # already late for
+                frame_index = frame_index + 1
+                remaining = start_time + frame_index * frame_delay - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                else:
+                    skip = int(-remaining / frame_delay)
+                    if METRICS.enabled and skip > 0:
+                        METRICS.count('player.dropped', skip)
+                    for skipped in range(skip):
+                        next(frames, None)
+                        frame_index = frame_index + 1
+        finally:
+            frames.close()
 
 
 #####
@@ -440,71 +1328,38 @@ class PixelPlayer(object):
 
 def colorAll(strip, color):
     """Set color of entire strand at once."""
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, color)
+    strip.fill(color)
     strip.show()
 
 
 def colorWipe(strip, color, wait_ms=50):
     """Wipe color across display a pixel at a time."""
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, color)
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.wipe(strip, color, wait_ms)
 
 
 def theaterChase(strip, color, wait_ms=50, iterations=5):
     """Movie theater marquee style chaser animation."""
-    for j in range(iterations):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, color)
-            strip.show()
-            time.sleep(wait_ms / 1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, Color(0, 0, 0))
+    effects.draw(strip, effects.theaterChase(strip.numPixels(), color, iterations), wait_ms)
 
 
 def wheel(pos):
     """Generate rainbow colors across 0-255 positions."""
-    if pos < 85:
-        return Color(pos * 3, 255 - pos * 3, 0)
-    elif pos < 170:
-        pos -= 85
-        return Color(255 - pos * 3, 0, pos * 3)
-    else:
-        pos -= 170
-        return Color(0, pos * 3, 255 - pos * 3)
+    return Color(*effects.wheel(pos).tolist())
 
 
 def rainbow(strip, wait_ms=20, iterations=1):
     """Draw rainbow that fades across all pixels at once."""
-    for j in range(256 * iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel((i + j) & 255))  # FIXME
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.draw(strip, effects.rainbow(strip.numPixels(), iterations), wait_ms)
 
 
 def rainbowCycle(strip, wait_ms=20, iterations=2):
     """Draw rainbow that uniformly distributes itself across all pixels."""
-    for j in range(256 * iterations):
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, wheel(((i * 256 // strip.numPixels()) + j) & 255))
-        strip.show()
-        time.sleep(wait_ms / 1000.0)
+    effects.draw(strip, effects.rainbowCycle(strip.numPixels(), iterations), wait_ms)
 
 
 def theaterChaseRainbow(strip, wait_ms=50):
     """Rainbow movie theater marquee style chaser animation."""
-    for j in range(256):
-        for q in range(3):
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, wheel((i + j) % 255))  # FIXME
-            strip.show()
-            time.sleep(wait_ms / 1000.0)
-            for i in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(i + q, Color(0, 0, 0))
+    effects.draw(strip, effects.theaterChaseRainbow(strip.numPixels()), wait_ms)
 
 
 #####
@@ -515,9 +1370,8 @@ def theaterChaseRainbow(strip, wait_ms=50):
 
 def colorWipeGrid(grid, color, wait_ms=50):
     """Wipe color across display a pixel at a time."""
-    theGrid = grid.getGrid()
-    for y in range(len(theGrid)):
-        for x in range(len(theGrid[y])):
+    for y in range(grid.numRows()):
+        for x in range(grid.rowLength(y)):
             grid.setPixelColor(x, y, color)
             grid.show()
             time.sleep(wait_ms / 1000.0)
@@ -525,10 +1379,9 @@ def colorWipeGrid(grid, color, wait_ms=50):
 
 def boatGrid(grid, wait_ms=5000):
     """Mark port and starboard end pixels of each row with red and green."""
-    theGrid = grid.getGrid()
-    for y in range(len(theGrid)):
+    for y in range(grid.numRows()):
         grid.setPixelColorRGB(0, y, 255, 0, 0)
-        end_x = len(theGrid[y]) - 1
+        end_x = grid.rowLength(y) - 1
         grid.setPixelColorRGB(end_x, y, 0, 255, 0)
         grid.show()
     time.sleep(wait_ms / 1000.0)
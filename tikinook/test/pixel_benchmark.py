@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Benchmark suite for the tiki nook pixel pipeline, run against the simulated
+strands (see simulator.py), so it runs anywhere and measures only the
+Python side.
+
+For each pixel layout and each case, reports frames per second, per-frame
+latency percentiles, and peak memory allocated while running. Results can
+be saved as JSON, and compared with an earlier run:
+
+    python3 pixel_benchmark.py --output before.json
+    ... make changes ...
+    python3 pixel_benchmark.py --output after.json --compare before.json
+
+Layouts:
+    nook       - the tiki nook: 271 NeoPixels + 50 PaleoPixels, with
+                 TIKI_NOOK_GRID
+    grid-WxH   - a synthetic zig-zag grid of W x H pixels (such as
+                 grid-64x64), on NeoPixels + 50 PaleoPixels
+
+Author: Mark Boszko (boszko+kilaueacove@gmail.com)
+
+License:
+Licensed under The MIT License (MIT). Please see LICENSE.txt for full text
+of the license.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# Run against the simulator, from the tikinook directory
+TIKINOOK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TIKINOOK_DIR)
+
+import hardware
+
+hardware.use_backend(hardware.SIMULATOR)
+
+import numpy
+
+import compositor
+import neopixel
+import paleopixel
+import superpixel
+
+# Clip used for the PixelPlayer cases
+BENCHMARK_CLIP = os.path.join(TIKINOOK_DIR, 'animation', 'volcano-v05-16x16.mov')
+
+DEFAULT_LAYOUTS = ['nook', 'grid-32x32']
+DEFAULT_FRAMES = 200
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+#####
+#
+# Layouts
+#
+#####
+
+def zigzag_grid(width, height):
+    """Return PixelGrid segments for a zig-zag strand of width x height
+    pixels, top row first.
+    """
+    segments = []
+    for row in range(height):
+        start = (height - 1 - row) * width
+        if row % 2 == 0:
+            segments.append((start, width))
+        else:
+            segments.append((start + width - 1, -width))
+    return segments
+
+
+def build_layout(name):
+    """Return (SuperPixel, PixelGrid) for a layout name."""
+    if name == 'nook':
+        pixel_count = superpixel.NEOPIXEL_COUNT + superpixel.PALEOPIXEL_COUNT
+        segments = superpixel.TIKI_NOOK_GRID
+    elif name.startswith('grid-'):
+        width, height = [int(size) for size in name[len('grid-'):].split('x')]
+        pixel_count = width * height
+        segments = zigzag_grid(width, height)
+    else:
+        raise ValueError('Unknown layout: {0}'.format(name))
+
+    paleopixel_count = min(superpixel.PALEOPIXEL_COUNT, pixel_count)
+    strands = [paleopixel.PaleoPixel(paleopixel_count)]
+    if pixel_count > paleopixel_count:
+        strands.insert(0, neopixel.Adafruit_NeoPixel(pixel_count - paleopixel_count, superpixel.NEOPIXEL_PIN))
+    strand = superpixel.SuperPixel(*strands)
+    strand.begin()
+    return strand, superpixel.PixelGrid(strand, *segments)
+
+
+class FrameClock(object):
+    def __init__(self, strand):
+        """Stands in for a strand, timestamping every show() as the end of
+        a frame, and passing everything else through.
+        """
+        self._strand = strand
+        self.frame_times = []
+
+    def __getattr__(self, name):
+        return getattr(self._strand, name)
+
+    def show(self, *args, **kwargs):
+        self._strand.show(*args, **kwargs)
+        self.frame_times.append(time.perf_counter())
+
+
+#####
+#
+# Cases
+#
+# Each case draws and shows frames on the clock (a FrameClock around the
+# SuperPixel) until it has shown the number of frames asked for.
+#
+#####
+
+def case_set_pixel_color(clock, grid, frames):
+    """SuperPixel.setPixelColor on every pixel, one at a time."""
+    color = superpixel.Color(10, 20, 30)
+    for frame in range(frames):
+        for n in range(clock.numPixels()):
+            clock.setPixelColor(n, color)
+        clock.show()
+
+
+def case_fade_to_colors(clock, grid, frames):
+    """SuperPixel.fade_to_colors, without the real-time pacing: one-second
+    fades up and down, FADE_FPS frames each.
+    """
+    targets = [numpy.full((clock.numPixels(), 3), 255), numpy.zeros((clock.numPixels(), 3))]
+    for fade in range(max(1, -(-frames // superpixel.FADE_FPS))):
+        # Run on the clock, so it times each frame's show()
+        superpixel.SuperPixel.fade_to_colors(clock, targets[fade % 2], 1.0, paced=False)
+
+
+def case_grid_rows(clock, grid, frames):
+    """PixelGrid.setRowColorRGB on every row."""
+    for frame in range(frames):
+        for row in range(grid.numRows()):
+            grid.setRowColorRGB(row, frame & 0xFF, row & 0xFF, 64)
+        clock.show()
+
+
+def case_grid_all(clock, grid, frames):
+    """PixelGrid.setAllColorRGB."""
+    for frame in range(frames):
+        grid.setAllColorRGB(frame & 0xFF, 0, 64)
+        clock.show()
+
+
+def case_player_load(clock, grid, frames):
+    """PixelPlayer decoding and compiling a clip, uncached. One 'frame' is
+    one whole load.
+    """
+    for frame in range(max(1, frames // 50)):
+        superpixel.PixelPlayer(grid, BENCHMARK_CLIP, cache=False)
+        clock.show()
+
+
+def case_player_play(clock, grid, frames):
+    """PixelPlayer.playSteps, looping, shown as fast as it will go."""
+    player = superpixel.PixelPlayer(grid, BENCHMARK_CLIP, cache=False)
+    steps = player.playSteps(loop=True)
+    for frame in range(frames):
+        next(steps)
+        clock.show()
+    steps.close()
+
+
+def case_rainbow_cycle(clock, grid, frames):
+    """superpixel.rainbowCycle, with no waits."""
+    superpixel.rainbowCycle(clock, wait_ms=0, iterations=max(1, frames // 256))
+
+
+def case_theater_chase(clock, grid, frames):
+    """superpixel.theaterChase, with no waits."""
+    superpixel.theaterChase(clock, superpixel.Color(127, 127, 127), wait_ms=0, iterations=max(1, frames // 3))
+
+
+def case_color_wipe(clock, grid, frames):
+    """superpixel.colorWipe, with no waits. Shows once per pixel."""
+    superpixel.colorWipe(clock, superpixel.Color(255, 0, 0), wait_ms=0)
+
+
+def case_composite(clock, grid, frames):
+    """Compositor with three layers (a full normal base, an added grid
+    layer, and a half-opacity max layer), all redrawn and flattened every
+    frame.
+    """
+    layers = compositor.Compositor(clock)
+    base = layers.addLayer('base')
+    glow = layers.addLayer('glow', grid, blend=compositor.BLEND_ADD)
+    sparkle = layers.addLayer('sparkle', numpy.arange(0, clock.numPixels(), 7), opacity=0.5,
+                              blend=compositor.BLEND_MAX)
+    for frame in range(frames):
+        base.fill((frame & 0xFF, 32, 64))
+        glow.grid().setRowColorRGB(frame % glow.grid().numRows(), 64, 64, 0)
+        sparkle.fill((255, 255, frame & 0xFF))
+        layers.show()
+
+
+CASES = [
+    ('setPixelColor', case_set_pixel_color),
+    ('fade_to_colors', case_fade_to_colors),
+    ('grid_rows', case_grid_rows),
+    ('grid_all', case_grid_all),
+    ('player_load', case_player_load),
+    ('player_play', case_player_play),
+    ('rainbowCycle', case_rainbow_cycle),
+    ('theaterChase', case_theater_chase),
+    ('colorWipe', case_color_wipe),
+    ('composite', case_composite),
+]
+
+
+#####
+#
+# Harness
+#
+#####
+
+def run_case(layout, case_name, case, frames):
+    """Run one case on a fresh layout, and return its results as a dict."""
+    # Timing run
+    strand, grid = build_layout(layout)
+    clock = FrameClock(strand)
+    grid = grid.onStrand(clock)
+    start_time = time.perf_counter()
+    case(clock, grid, frames)
+    elapsed = time.perf_counter() - start_time
+    frame_times = numpy.diff([start_time] + clock.frame_times) * 1000.0
+
+    # Allocation run, separately, since tracing slows everything down
+    strand, grid = build_layout(layout)
+    clock = FrameClock(strand)
+    grid = grid.onStrand(clock)
+    tracemalloc.start()
+    case(clock, grid, frames)
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    shown = len(frame_times)
+    result = {
+        'layout': layout,
+        'pixels': strand.numPixels(),
+        'case': case_name,
+        'frames': shown,
+        'seconds': elapsed,
+        'fps': shown / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {},
+        'alloc_peak_kb': peak_bytes / 1024.0,
+        'alloc_retained_kb': current_bytes / 1024.0,
+    }
+    for percentile in LATENCY_PERCENTILES:
+        result['latency_ms']['p{0}'.format(percentile)] = float(numpy.percentile(frame_times, percentile))
+    result['latency_ms']['max'] = float(frame_times.max())
+    return result
+
+
+def compare(results, previous):
+    """Print each result's fps against the same layout and case in an
+    earlier run's results.
+    """
+    before = {(result['layout'], result['case']): result for result in previous['results']}
+    print('')
+    print('{0:<12} {1:<16} {2:>10} {3:>10} {4:>8}'.format('layout', 'case', 'fps before', 'fps now', 'change'))
+    for result in results:
+        old = before.get((result['layout'], result['case']))
+        if old is None or old['fps'] == 0:
+            continue
+        change = (result['fps'] - old['fps']) / old['fps'] * 100.0
+        print('{0:<12} {1:<16} {2:>10.1f} {3:>10.1f} {4:>+7.1f}%'.format(result['layout'], result['case'],
+                                                                       old['fps'], result['fps'], change))
+
+
+# Main program logic follows:
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pixel pipeline on simulated strands')
+    parser.add_argument('--layouts', nargs='+', default=DEFAULT_LAYOUTS, help='nook, or grid-WxH')
+    parser.add_argument('--cases', nargs='+', default=[name for name, case in CASES], help='Cases to run')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='Frames per case')
+    parser.add_argument('--output', help='Save results to this JSON file')
+    parser.add_argument('--compare', help='Compare with results saved in this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('{0:<12} {1:>6} {2:<16} {3:>6} {4:>10} {5:>8} {6:>8} {7:>8} {8:>10}'.format(
+        'layout', 'pixels', 'case', 'frames', 'fps', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KiB'))
+    for layout in args.layouts:
+        for case_name, case in CASES:
+            if case_name not in args.cases:
+                continue
+            result = run_case(layout, case_name, case, args.frames)
+            results.append(result)
+            print('{0:<12} {1:>6} {2:<16} {3:>6} {4:>10.1f} {5:>8.3f} {6:>8.3f} {7:>8.3f} {8:>10.1f}'.format(
+                layout, result['pixels'], case_name, result['frames'], result['fps'],
+                result['latency_ms']['p50'], result['latency_ms']['p90'], result['latency_ms']['p99'],
+                result['alloc_peak_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': numpy.__version__,
+                'machine': platform.machine(),
+                'frames': args.frames,
+                'results': results,
+            }, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare(results, json.load(compare_file))